@@ -0,0 +1,75 @@
+"""encode_audio（WAV そのまま）と encode_audio_compact（16kHz）の比較。
+
+リポジトリのルートで実行する:
+
+    python -m benchmarks.encode_audio --seconds 60
+"""
+import argparse
+import io
+import json
+import math
+import struct
+import time
+import tracemalloc
+import wave
+
+import util
+
+
+def make_wav(seconds: float, sample_rate: int = 48_000, channels: int = 2) -> bytes:
+    frames = int(seconds * sample_rate)
+    one = bytearray()
+    for i in range(sample_rate):
+        v = int(8000 * math.sin(2 * math.pi * 440 * i / sample_rate))
+        one += struct.pack("<h", v) * channels
+    reps, rest = divmod(frames, sample_rate)
+    pcm = bytes(one) * reps + bytes(one[:rest * 2 * channels])
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(pcm)
+    return buf.getvalue()
+
+
+def legacy_body(audio_bytes: bytes) -> bytes:
+    payload = {"config": {"languageCode": "ja-JP"},
+               "audio": {"content": util.encode_audio(audio_bytes)}}
+    return json.dumps(payload).encode("utf-8")
+
+
+def compact_body(audio_bytes: bytes) -> bytearray:
+    encoded, config = util.encode_audio_compact(audio_bytes)
+    return util._build_body({"config": {"languageCode": "ja-JP", **config}},
+                            encoded)
+
+
+def measure(fn, audio_bytes: bytes):
+    tracemalloc.start()
+    start = time.perf_counter()
+    body = fn(audio_bytes)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(body), peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--rate", type=int, default=48_000)
+    parser.add_argument("--channels", type=int, default=2)
+    args = parser.parse_args()
+
+    audio_bytes = make_wav(args.seconds, args.rate, args.channels)
+    print(f"input: {len(audio_bytes) / 1e6:.1f} MB "
+          f"({args.seconds:g}s, {args.rate} Hz, {args.channels}ch)")
+    print(f"{'path':<10}{'payload MB':>12}{'peak MB':>10}{'time s':>9}")
+    for name, fn in [("legacy", legacy_body), ("compact", compact_body)]:
+        size, peak, elapsed = measure(fn, audio_bytes)
+        print(f"{name:<10}{size / 1e6:>12.2f}{peak / 1e6:>10.1f}{elapsed:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""外部 API のローカル代替サーバー（ネットワークなしでページを動かすため）。
+
+1つの HTTP サーバーで次の API を真似る。遅延・レスポンスの大きさ・エラー率は設定できる。
+
+    POST /v1/speech:recognize         Speech-to-Text（STT_ENDPOINT）
+    POST /v1/images:annotate          Vision の REST（VISION_ENDPOINT）
+    POST .../chat/completions         Hugging Face のチャット（HF_CHAT_ENDPOINT、SSE）
+    POST /models/<model>              Hugging Face の画像生成（HF_API_BASE）
+    HEAD/GET /result/<名前>.webp      enamae.net の姓名判断画像（ENAMAE_BASE）
+
+単体でも起動できる。リポジトリのルートで:
+
+    python -m benchmarks.fake_services --port 8765 --latency 0.2 --error-rate 0.05
+
+表示される環境変数を設定して streamlit run すれば、ブラウザからも試せる。
+"""
+import argparse
+import json
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+
+_LABELS = ["Cat", "Dog", "Sky", "Tree", "Flower", "Building", "Car", "Food",
+           "Person", "Water", "Mountain", "Cloud", "Grass", "Road", "Bird", "Toy"]
+# Google の API はエラーを {"error": {...}}、Hugging Face は {"error": "..."} で返す
+_GOOGLE_ROUTES = {"stt", "vision"}
+_WORDS = ["今日", "は", "雷", "が", "鳴って", "いる", "けど", "大丈夫", "だよ", "ね"]
+
+
+def make_png(width: int, height: int, seed=None) -> bytes:
+    """ランダムな画素の PNG を作る（ほとんど圧縮されないので大きさを調整しやすい）。"""
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 1))
+            + chunk(b"IEND", b""))
+
+
+def png_of_size(nbytes: int, seed=None) -> bytes:
+    side = max(int((nbytes / 3) ** 0.5), 8)
+    return make_png(side, side, seed)
+
+
+class FakeConfig:
+    """代替サーバーの振る舞い。時間はすべて秒。
+
+    latency と jitter はレスポンスを返し始めるまでの遅延（チャットでは最初の
+    トークンまで）。error_rate の割合のリクエストには 503 を返す。
+    """
+
+    def __init__(self, *, latency: float = 0.1, jitter: float = 0.0,
+                 error_rate: float = 0.0, words: int = 40, labels: int = 10,
+                 tokens: int = 60, token_interval: float = 0.01,
+                 image_bytes: int = 256 * 1024, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.words = words
+        self.labels = min(labels, len(_LABELS))
+        self.tokens = tokens
+        self.token_interval = token_interval
+        self.image_bytes = image_bytes
+        self.seed = seed
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive を使い、アプリ側のコネクションプールがそのまま効くようにする
+    protocol_version = "HTTP/1.1"
+    server: "FakeServices"
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- 共通 ---
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+    def _delay_or_fail(self, route):
+        """設定どおりに待ち、エラーにするリクエストなら 503 を返して True。"""
+        cfg = self.server.config
+        self.server.record(route)
+        time.sleep(max(cfg.latency + random.uniform(-cfg.jitter, cfg.jitter), 0))
+        if random.random() < cfg.error_rate:
+            self.server.record(route, error=True)
+            if route in _GOOGLE_ROUTES:
+                error = {"code": 503, "message": "fake overload", "status": "UNAVAILABLE"}
+            else:
+                error = "fake overload"
+            self._send_json(503, {"error": error})
+            return True
+        return False
+
+    # --- ルーティング ---
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self._body()
+        if path == "/v1/speech:recognize":
+            self._recognize()
+        elif path == "/v1/images:annotate":
+            self._annotate(json.loads(body))
+        elif path.endswith("/chat/completions"):
+            self._chat(json.loads(body))
+        elif path.startswith("/models/"):
+            self._text_to_image()
+        else:
+            self._send_json(404, {"error": f"unknown path: {path}"})
+
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path)
+        if path.startswith("/result/"):
+            self._onomancy(path)
+        elif path.startswith("/img/"):
+            self._send(200, b"RIFF\x00\x00\x00\x00WEBP", content_type="image/webp")
+        else:
+            self._send_json(404, {"error": f"unknown path: {path}"})
+
+    do_HEAD = do_GET
+
+    # --- 各 API ---
+
+    def _recognize(self):
+        if self._delay_or_fail("stt"):
+            return
+        words = []
+        for i in range(self.server.config.words):
+            words.append({"word": _WORDS[i % len(_WORDS)],
+                          "startTime": f"{i * 0.3:.1f}s", "endTime": f"{i * 0.3 + 0.25:.2f}s"})
+        self._send_json(200, {"results": [{"alternatives": [{
+            "transcript": "".join(w["word"] for w in words), "confidence": 0.9,
+            "words": words}]}]})
+
+    def _annotate(self, payload):
+        if self._delay_or_fail("vision"):
+            return
+        n = self.server.config.labels
+        responses = []
+        for _ in payload.get("requests", []):
+            labels = random.sample(_LABELS, n)
+            responses.append({"labelAnnotations": [
+                {"description": d, "score": round(1 - i / (n + 1), 3), "topicality": 0.5}
+                for i, d in enumerate(labels)]})
+        self._send_json(200, {"responses": responses})
+
+    def _chat(self, payload):
+        if self._delay_or_fail("hf.chat"):
+            return
+        cfg = self.server.config
+        n = min(cfg.tokens, payload.get("max_tokens") or cfg.tokens)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        created = int(time.time())
+        for i in range(n):
+            chunk = {"id": "fake", "object": "chat.completion.chunk", "created": created,
+                     "model": "fake", "system_fingerprint": "fake",
+                     "choices": [{"index": 0, "logprobs": None,
+                                  "finish_reason": "length" if i == n - 1 else None,
+                                  "delta": {"role": "assistant",
+                                            "content": _WORDS[i % len(_WORDS)]}}]}
+            write(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n")
+            if cfg.token_interval:
+                time.sleep(cfg.token_interval)
+        write(b"data: [DONE]\n\n")
+        write(b"")
+
+    def _text_to_image(self):
+        if self._delay_or_fail("hf.image"):
+            return
+        self._send(200, self.server.image, content_type="image/png")
+
+    def _onomancy(self, path):
+        if self._delay_or_fail("enamae"):
+            return
+        name = path[len("/result/"):]
+        self._send(302, headers={"Location": "/img/" + quote(name)})
+
+
+class FakeServices(ThreadingHTTPServer):
+    """すべての代替 API をまとめた HTTP サーバー。start() で別スレッドで動かす。"""
+
+    daemon_threads = True
+
+    def __init__(self, config: FakeConfig = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.config = config or FakeConfig()
+        self.image = png_of_size(self.config.image_bytes, self.config.seed)
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self.errors = Counter()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # 負荷テストのセッションのプロセスが終わると keep-alive の接続が切れるが、失敗ではない
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def record(self, route, error=False):
+        with self._lock:
+            (self.errors if error else self.requests)[route] += 1
+
+    def environ(self) -> dict:
+        """アプリをこのサーバーに向けるための環境変数。"""
+        base = self.base_url
+        return {
+            "STT_ENDPOINT": f"{base}/v1/speech:recognize",
+            "VISION_ENDPOINT": base,
+            "HF_CHAT_ENDPOINT": f"{base}/hf-chat",
+            "HF_API_BASE": f"{base}/models",
+            "ENAMAE_BASE": base,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.1,
+                        help="レスポンスまでの遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延の揺らぎ（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="503 を返す割合（0〜1）")
+    parser.add_argument("--words", type=int, default=40, help="音声認識の単語数")
+    parser.add_argument("--labels", type=int, default=10, help="画像1枚あたりのラベル数")
+    parser.add_argument("--tokens", type=int, default=60, help="チャットの応答トークン数")
+    parser.add_argument("--token-interval", type=float, default=0.01,
+                        help="チャットのトークンの間隔（秒）")
+    parser.add_argument("--image-kb", type=int, default=256, help="生成画像の大きさ（KB）")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args) -> FakeConfig:
+    return FakeConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      words=args.words, labels=args.labels, tokens=args.tokens,
+                      token_interval=args.token_interval, image_bytes=args.image_kb * 1024,
+                      seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeServices(config_from_args(args), args.host, args.port)
+    for key, value in server.environ().items():
+        print(f"export {key}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"requests: {dict(server.requests)} errors: {dict(server.errors)}",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
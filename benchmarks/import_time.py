@@ -0,0 +1,120 @@
+"""ページごとのコールドスタート時の import コスト（python -X importtime）。
+
+ページごとに新しいプロセスで streamlit を読み込んだあと、ページのスクリプトを
+素の状態（ボタンは押されず、ファイルもない）で1回実行し、そのあいだに読み込まれた
+モジュールの時間を集計する。リポジトリのルートで:
+
+    python -m benchmarks.import_time --repeat 3
+    python -m benchmarks.import_time pages/chat.py --top 10
+"""
+import argparse
+import glob
+import json
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+# 使うまで読み込まないはずの重いライブラリ。ページを開いただけで読み込まれたら表示する
+HEAVY_MODULES = ("google.cloud.vision", "google.oauth2", "huggingface_hub", "pydub",
+                 "sklearn", "joblib", "altair", "pyarrow")
+
+_MARKER = "--- page start ---"
+
+_CHILD = """
+import json, sys, time, runpy
+sys.path.insert(0, ".")
+import streamlit
+before = set(sys.modules)
+print({marker!r}, file=sys.stderr, flush=True)
+error = None
+t0 = time.perf_counter()
+try:
+    runpy.run_path({page!r}, run_name="__main__")
+except BaseException as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+elapsed = time.perf_counter() - t0
+heavy = sorted(m for m in {heavy!r} if m in sys.modules and m not in before)
+print(json.dumps({{"run": elapsed, "modules": len(set(sys.modules) - before),
+                  "heavy": heavy, "error": error}}))
+"""
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+def parse_importtime(stderr):
+    """マーカー以降のトップレベルの import を、パッケージごとの累積時間（秒）にまとめる。"""
+    by_package = defaultdict(float)
+    started = False
+    for line in stderr.splitlines():
+        if line.strip() == _MARKER:
+            started = True
+            continue
+        m = _LINE.match(line)
+        # 入れ子の import はインデントが深い。親の累積時間に含まれている
+        if not started or m is None or len(m.group(3)) != 1:
+            continue
+        by_package[m.group(4).split(".")[0]] += int(m.group(2)) / 1e6
+    return dict(by_package)
+
+
+def run_child(page):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         _CHILD.format(marker=_MARKER, page=page, heavy=HEAVY_MODULES)],
+        capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{page}: {proc.stderr.strip().splitlines()[-1:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["packages"] = parse_importtime(proc.stderr)
+    result["import"] = sum(result["packages"].values())
+    return result
+
+
+def summarize(page, runs, top):
+    packages = defaultdict(list)
+    for r in runs:
+        for name, seconds in r["packages"].items():
+            packages[name].append(seconds)
+    ranked = sorted(((statistics.median(v), k) for k, v in packages.items()), reverse=True)
+    return {
+        "page": page,
+        "import_ms": statistics.median(r["import"] for r in runs) * 1000,
+        "run_ms": statistics.median(r["run"] for r in runs) * 1000,
+        "modules": runs[-1]["modules"],
+        "heavy": runs[-1]["heavy"],
+        "error": runs[-1]["error"],
+        "top": [(name, seconds * 1000) for seconds, name in ranked[:top]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pages", nargs="*",
+                        help="計測するページ（省略時は index.py と pages/*.py）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5,
+                        help="ページごとに表示する重いパッケージの数")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    args = parser.parse_args()
+
+    pages = args.pages or ["index.py"] + sorted(glob.glob("pages/*.py"))
+    results = [summarize(page, [run_child(page) for _ in range(args.repeat)], args.top)
+               for page in pages]
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"{'page':<28}{'import ms':>11}{'run ms':>10}{'modules':>9}  heavy")
+    for r in results:
+        print(f"{r['page']:<28}{r['import_ms']:>11.1f}{r['run_ms']:>10.1f}"
+              f"{r['modules']:>9}  {', '.join(r['heavy']) or '-'}")
+        for name, ms in r["top"]:
+            print(f"    {name:<24}{ms:>11.1f}")
+        if r["error"]:
+            print(f"    (ページの実行で例外: {r['error']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""ネットワークなしで各ページを並行に動かす負荷テスト。
+
+benchmarks/fake_services.py の代替サーバーを起動し、外部 API の宛先を環境変数で
+そちらに向けてから、N 個のセッションをそれぞれ別プロセスの Streamlit AppTest で
+同時に動かす（AppTest はプロセス全体の Runtime を差し替えるので、1つのプロセスでは
+同時に1つしか動かせない）。セッションはページを順に開き、開く（load）のと、
+ボタンなどの操作（action）ごとの時間を測る。結果は親プロセスでまとめて、
+スループット・ページごとのパーセンタイル・メモリを表示する。リポジトリのルートで:
+
+    python -m benchmarks.load_test --sessions 8 --iterations 5
+    python -m benchmarks.load_test --pages chat image_gen --latency 0.5 --error-rate 0.1
+    python -m benchmarks.load_test --save bench.json            # 基準として保存
+    python -m benchmarks.load_test --baseline bench.json        # p95 が悪化したら終了コード 1
+
+キャッシュ（.cache/）は一時ディレクトリに作るので、毎回キャッシュなしの状態から測る。
+st.cache_resource などのプロセス内のキャッシュはセッションごとに別になる。
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import sys
+import tempfile
+import time
+import traceback
+import wave
+
+from streamlit.testing.v1 import AppTest
+
+import metrics
+from benchmarks.fake_services import FakeServices, add_arguments, config_from_args, make_png
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRETS = {"hugging_face_token": "bench", "gcp_key": "bench"}
+# 全セッションのプロセスが起動するのを待つ上限（秒）
+_START_TIMEOUT = 300
+
+
+def make_wav(seconds: float, seed=None, sample_rate: int = 16_000) -> bytes:
+    """ノイズだけの 16bit モノラル WAV。"""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(random.Random(seed).randbytes(int(seconds * sample_rate) * 2))
+    return buf.getvalue()
+
+
+# --- ページごとの操作。(AppTest, セッション番号, 回数, 引数) を受け取る ---
+
+def _rerun(at, session, i, args):
+    at.run()
+
+
+def _chat(at, session, i, args):
+    at.chat_input[0].set_value(f"大丈夫だよ、先生がそばにいるからね（{session}-{i}）").run()
+
+
+def _image_gen(at, session, i, args):
+    # 同じプロンプトだとキャッシュから返るので、毎回変える
+    at.text_input[0].set_value(f"a cat under the thunder #{session}-{i}")
+    at.button[0].click().run()
+    deadline = time.monotonic() + args.timeout
+    # 生成はバックグラウンドで進むので、結果が出るまで再実行して待つ
+    while not (at.success or at.error or at.exception):
+        if time.monotonic() > deadline:
+            raise TimeoutError("image generation did not finish")
+        time.sleep(args.poll_interval)
+        at.run()
+
+
+def _computer_vision(at, session, i, args):
+    at.file_uploader[0].set_value([
+        (f"{session}-{i}-{n}.png", make_png(320, 240, seed=f"{session}-{i}-{n}"), "image/png")
+        for n in range(args.images)]).run()
+    at.button[0].click().run()
+
+
+def _audio_app(at, session, i, args):
+    # アップロード欄はラジオを切り替えてから表示される
+    at.radio[0].set_value("ファイルアップロード").run()
+    at.file_uploader[0].set_value(
+        ("voice.wav", make_wav(args.audio_seconds, seed=f"{session}-{i}"), "audio/wav")).run()
+    at.button[0].click().run()
+
+
+def _test(at, session, i, args):
+    # onomancy は名前ごとに結果を覚えるので、毎回違う名前にする
+    at.text_input[0].set_value("山田")
+    at.text_input[1].set_value(f"太郎{session}x{i}")
+    at.button[0].click().run()
+
+
+def _ml_app(at, session, i, args):
+    at.number_input[0].set_value(18 + (session + i) % 40)
+    at.radio[0].set_value("Male")
+    at.radio[1].set_value("Single")
+    at.button[0].click().run()
+
+
+SCENARIOS = {
+    "index": ("index.py", _rerun),
+    "audio_app": ("pages/audio_app.py", _audio_app),
+    "computer_vision": ("pages/computer_vision.py", _computer_vision),
+    "chat": ("pages/chat.py", _chat),
+    "image_gen": ("pages/image_gen.py", _image_gen),
+    "test": ("pages/test.py", _test),
+    "ml_app": ("pages/ml_app.py", _ml_app),
+    "performance": ("pages/performance.py", _rerun),
+}
+
+
+# 失敗として数える st.warning（それ以外の警告は、途中までの応答やスキップした行など
+# アプリが想定している表示なので数えない）
+_FAILURE_WARNINGS = ("応答を取得できませんでした",)
+
+
+def _failed(at):
+    if at.exception or at.error:
+        return True
+    return any(w.value.startswith(_FAILURE_WARNINGS) for w in at.warning)
+
+
+def run_session(page, session, args):
+    """1つのセッションでページを開き、操作を iterations 回くり返す。"""
+    path, act = SCENARIOS[page]
+    at = AppTest.from_file(os.path.join(ROOT, path), default_timeout=args.timeout)
+    for key, value in SECRETS.items():
+        at.secrets[key] = value
+    with metrics.timed(f"bench.{page}.load") as timer:
+        try:
+            at.run()
+        except Exception:
+            timer.mark_error()
+            return
+        if at.exception:
+            timer.mark_error()
+    for i in range(args.iterations):
+        with metrics.timed(f"bench.{page}.action") as timer:
+            try:
+                act(at, session, i, args)
+            except Exception:
+                # タイムアウトなども失敗として数え、次の操作に進む
+                timer.mark_error()
+            else:
+                if _failed(at):
+                    timer.mark_error()
+
+
+def _rss():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _session_process(session, pages, args, ready, results):
+    """1つのセッションを担当するプロセス。ページを順に動かし、計測値を results に送る。"""
+    result = {"session": session, "error": None}
+    rss_start = _rss()
+    try:
+        ready.wait(_START_TIMEOUT)
+        for page in pages:
+            run_session(page, session, args)
+    except Exception:
+        result["error"] = traceback.format_exc()
+    finally:
+        result.update(metrics=metrics.export(), rss_start=rss_start, rss_end=_rss(),
+                      rss_peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+        results.put(result)
+
+
+def run(args, server):
+    os.environ.update(server.environ())
+    metrics.reset()
+
+    # 各プロセスは新しく起動し（fork しない）、streamlit などを読み込んでから揃って始める。
+    # 同じページばかりが同時に動かないよう、セッションごとに開く順番をずらす
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Barrier(args.sessions + 1)
+    results = ctx.Queue()
+    procs = []
+    for s in range(args.sessions):
+        k = s % len(args.pages)
+        pages = args.pages[k:] + args.pages[:k]
+        procs.append(ctx.Process(target=_session_process,
+                                 args=(s, pages, args, ready, results), daemon=True))
+    for p in procs:
+        p.start()
+    ready.wait(_START_TIMEOUT)
+    start = time.perf_counter()
+
+    sessions = []
+    while len(sessions) < len(procs):
+        try:
+            sessions.append(results.get(timeout=1))
+        except queue.Empty:
+            # 結果を送らずに落ちたプロセスがあれば、残りは待たない
+            if not any(p.is_alive() for p in procs) and results.empty():
+                break
+    elapsed = time.perf_counter() - start
+    for p in procs:
+        p.join()
+
+    for r in sessions:
+        metrics.merge(r["metrics"])
+        if r["error"]:
+            print(f"session {r['session']} failed:\n{r['error']}", file=sys.stderr)
+    rows = metrics.snapshot()
+    pages = {}
+    for row in rows:
+        if row["name"].startswith("bench."):
+            _, page, kind = row["name"].split(".")
+            pages.setdefault(page, {})[kind] = row
+    interactions = sum(row["count"] for page in pages.values() for row in page.values())
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("save", "baseline")},
+        "elapsed_s": elapsed,
+        "throughput_per_s": interactions / elapsed if elapsed else 0.0,
+        "pages": pages,
+        # セッション（プロセス）ごとの RSS。開始時はページを開く前
+        "memory": {"sessions": len(sessions),
+                   "lost_sessions": len(procs) - len(sessions),
+                   "rss_start_mb": max((r["rss_start"] for r in sessions), default=0) / 1e6,
+                   "rss_peak_mb": max((r["rss_peak"] for r in sessions), default=0) / 1e6,
+                   "rss_end_mb": max((r["rss_end"] for r in sessions), default=0) / 1e6,
+                   "rss_peak_total_mb": sum(r["rss_peak"] for r in sessions) / 1e6},
+        "app_metrics": [row for row in rows if not row["name"].startswith("bench.")],
+        "app_counters": metrics.counters(),
+        "fake_requests": dict(server.requests),
+        "fake_errors": dict(server.errors),
+    }
+
+
+def report(result):
+    print(f"{'page':<18}{'kind':<8}{'count':>7}{'errors':>8}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for page, kinds in result["pages"].items():
+        for kind, row in kinds.items():
+            print(f"{page:<18}{kind:<8}{row['count']:>7}{row['errors']:>8}"
+                  f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    memory = result["memory"]
+    print(f"\n{result['elapsed_s']:.1f} 秒, {result['throughput_per_s']:.2f} 操作/秒, "
+          f"セッションあたりの RSS {memory['rss_start_mb']:.0f} → 最大 "
+          f"{memory['rss_peak_mb']:.0f} MB（{memory['sessions']} プロセスの合計 "
+          f"{memory['rss_peak_total_mb']:.0f} MB）")
+    if memory["lost_sessions"]:
+        print(f"結果を返さなかったセッション: {memory['lost_sessions']}")
+    print(f"代替サーバーへのリクエスト: {result['fake_requests']} "
+          f"（うちエラー {result['fake_errors']}）")
+    print("\nアプリ内の計測（p95 の大きい順）:")
+    for row in sorted(result["app_metrics"], key=lambda r: -r["p95_ms"])[:10]:
+        print(f"    {row['name']:<40}{row['count']:>7}{row['p95_ms']:>10.1f}")
+    if result["app_counters"]:
+        print(f"    回数: {result['app_counters']}")
+
+
+def regressions(result, baseline, tolerance):
+    """基準より p95 が tolerance の割合を超えて遅くなったページを返す。"""
+    found = []
+    for page, kinds in result["pages"].items():
+        for kind, row in kinds.items():
+            base = baseline["pages"].get(page, {}).get(kind)
+            if base and row["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                found.append(f"{page}.{kind}: p95 {base['p95_ms']:.1f} → {row['p95_ms']:.1f} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", nargs="+", choices=list(SCENARIOS),
+                        default=[p for p in SCENARIOS if p not in ("index", "performance")])
+    parser.add_argument("--sessions", type=int, default=4, help="同時に動かすセッション数（それぞれ別プロセス）")
+    parser.add_argument("--iterations", type=int, default=3,
+                        help="セッションごとの操作の回数")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="1回の実行・画像生成を待つ上限（秒）")
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--images", type=int, default=1,
+                        help="画像認識で1回にアップロードする枚数")
+    parser.add_argument("--audio-seconds", type=float, default=5.0)
+    add_arguments(parser)
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    parser.add_argument("--save", help="結果を JSON で保存するパス")
+    parser.add_argument("--baseline", help="比較する基準の JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="基準から許容する p95 の悪化の割合")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    save = os.path.abspath(args.save) if args.save else None
+
+    server = FakeServices(config_from_args(args)).start()
+    workdir = tempfile.TemporaryDirectory(prefix="load_test_")
+    cwd = os.getcwd()
+    try:
+        # ページは ./assets と ./.cache を相対パスで使うので、一時ディレクトリから動かす
+        os.symlink(os.path.join(ROOT, "assets"), os.path.join(workdir.name, "assets"))
+        os.chdir(workdir.name)
+        sys.path.insert(0, ROOT)
+        result = run(args, server)
+    finally:
+        os.chdir(cwd)
+        server.stop()
+        workdir.cleanup()
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        report(result)
+    if save:
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if baseline is not None:
+        found = regressions(result, baseline, args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""model.pkl（pickle）と変換済み joblib 形式のコールドスタート比較。
+
+毎回新しいプロセスで読み込み、読み込み時間と RSS を測る。リポジトリのルートで:
+
+    python -m benchmarks.model_load --repeat 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+import model_store
+
+_CHILD = """
+import json, resource, time
+t0 = time.perf_counter()
+import model_store
+t1 = time.perf_counter()
+if {mode!r} == "pickle":
+    model = model_store.load_pickle()
+else:
+    import joblib, os
+    model = joblib.load(os.path.join(model_store.STORE_DIR, "model.joblib"),
+                        mmap_mode={mmap!r})
+t2 = time.perf_counter()
+rss = 0
+with open("/proc/self/status") as f:
+    for line in f:
+        if line.startswith("VmRSS:"):
+            rss = int(line.split()[1]) * 1024
+print(json.dumps({{"import": t1 - t0, "load": t2 - t1, "rss": rss}}))
+"""
+
+_MODES = [("pickle", "pickle", None), ("joblib", "joblib", None),
+          ("joblib+mmap", "joblib", "r")]
+
+
+def run_child(mode, mmap):
+    out = subprocess.run([sys.executable, "-c", _CHILD.format(mode=mode, mmap=mmap)],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if not model_store.is_current():
+        print("converting model...")
+        model_store.convert()
+
+    print(f"{'format':<14}{'import ms':>11}{'load ms':>10}{'RSS MB':>9}")
+    for label, mode, mmap in _MODES:
+        runs = [run_child(mode, mmap) for _ in range(args.repeat)]
+        print(f"{label:<14}"
+              f"{statistics.median(r['import'] for r in runs) * 1000:>11.1f}"
+              f"{statistics.median(r['load'] for r in runs) * 1000:>10.1f}"
+              f"{statistics.median(r['rss'] for r in runs) / 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
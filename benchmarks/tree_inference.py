@@ -0,0 +1,81 @@
+"""model.predict（pandas + sklearn）と CompiledModel の予測レイテンシ比較。
+
+結果が一致することも確認する。リポジトリのルートで:
+
+    python -m benchmarks.tree_inference --records 1000
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+import model_store
+from fast_model import CompiledModel
+
+
+def random_records(model, n, seed=0):
+    rng = random.Random(seed)
+    prep = model.named_steps["preprocessor"]
+    cat = prep.named_transformers_["cat"]
+    categories = dict(zip(cat.feature_names_in_, cat.categories_))
+    records = []
+    for _ in range(n):
+        record = {c: rng.choice(list(v)) for c, v in categories.items()}
+        record.update({
+            "Age": rng.randint(15, 40),
+            "Avg_Daily_Usage_Hours": round(rng.uniform(0, 10), 1),
+            "Sleep_Hours_Per_Night": rng.randint(3, 11),
+            "Conflicts_Over_Social_Media": rng.randint(0, 5),
+        })
+        records.append(record)
+    return records
+
+
+def per_call_us(fn, items, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=1000)
+    args = parser.parse_args()
+
+    model = model_store.load()
+    engine = CompiledModel(model)
+    colnames = list(model.named_steps["preprocessor"].feature_names_in_)
+    records = random_records(model, args.records)
+
+    expected = model.predict(pd.DataFrame(records, columns=colnames))
+    actual = engine.predict(records)
+    diff = np.abs(expected - actual).max()
+    print(f"max |model.predict - CompiledModel| over {len(records)} records: {diff:.3g}")
+
+    singles = records[:200]
+    sk = per_call_us(lambda r: model.predict(pd.DataFrame([r], columns=colnames)),
+                     singles)
+    fast = per_call_us(engine.predict_one, singles)
+    print(f"{'single record':<16}{'sklearn us':>12}{'compiled us':>13}{'speedup':>9}")
+    print(f"{'':<16}{sk:>12.1f}{fast:>13.1f}{sk / fast:>8.1f}x")
+
+    print(f"{'batch size':<16}{'sklearn us/row':>15}{'compiled us/row':>16}")
+    for size in [8, 64, 512]:
+        if size > len(records):
+            # --records が少ないときは作れない大きさのバッチを飛ばす
+            break
+        batches = [records[i:i + size] for i in range(0, len(records) - size + 1, size)]
+        sk = per_call_us(lambda b: model.predict(pd.DataFrame(b, columns=colnames)),
+                         batches) / size
+        fast = per_call_us(engine.predict, batches) / size
+        print(f"{size:<16}{sk:>15.2f}{fast:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+from collections import deque
+
+
+def count_tokens(text: str) -> int:
+    """トークン数の見積もり。
+
+    gemma のトークナイザでは日本語はおおよそ1文字1トークン、英数字は
+    4文字で1トークン程度になる。
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return len(text) - ascii_chars + (ascii_chars + 3) // 4
+
+
+# role などメッセージごとの書式分
+_MESSAGE_OVERHEAD = 4
+_SUMMARY_HEADER = "（これまでの会話の要約）"
+
+
+class ContextBudget:
+    """チャット履歴をトークン予算に収めてリクエスト用のメッセージを作る。
+
+    先頭の pinned 件（システムメッセージと初期会話）はそのまま残し、
+    予算を超えそうなら古いやりとりから短い要約に置き換えていく。
+    要約は summary_tokens までに抑え、あふれたら古い行から捨てるので、
+    会話が長くなっても直近の発言はそのまま残る。
+    instruction はリクエストごとに最後に1回だけ付ける。
+    """
+
+    def __init__(self, max_tokens: int = 8192, reserve: int = 500, *,
+                 count=count_tokens, summary_chars: int = 40,
+                 summary_tokens: int = 1024):
+        self.max_tokens = max_tokens
+        self.reserve = reserve
+        self.count = count
+        self.summary_chars = summary_chars
+        self.summary_tokens = summary_tokens
+
+    def tokens(self, messages) -> int:
+        return sum(self.count(m["content"]) + _MESSAGE_OVERHEAD for m in messages)
+
+    def _line(self, message) -> str:
+        text = message["content"].replace("\n", " ")
+        if len(text) > self.summary_chars:
+            text = text[:self.summary_chars] + "…"
+        return text
+
+    def _summary(self, lines):
+        return {"role": "system",
+                "content": "\n".join([_SUMMARY_HEADER] + [text for text, _ in lines])}
+
+    def build(self, log, *, pinned: int, instruction: str = None):
+        """(送るメッセージ, 見積もりトークン数, 要約したメッセージ数) を返す。"""
+        log = [{"role": m["role"], "content": m["content"]} for m in log
+               if m["content"] != instruction]
+        head, turns = log[:pinned], log[pinned:]
+        tail = [{"role": "system", "content": instruction}] if instruction else []
+        budget = self.max_tokens - self.reserve
+
+        # トークン数は1件につき1回だけ数え、捨てるたびに差し引く。要約は
+        # summary_tokens までなので、作り直しても全体の長さには比例しない
+        sizes = [self.count(m["content"]) + _MESSAGE_OVERHEAD for m in turns]
+        total = self.tokens(head) + self.tokens(tail) + sum(sizes)
+        # 要約の行と、そのトークン数（区切りの改行込み）。新しい行を右に足し、
+        # summary_tokens を超えたら左の古い行から捨てる
+        lines = deque()
+        line_tokens = self.count(_SUMMARY_HEADER)
+        summary = []
+        cut = 0
+        # 直近のメッセージは必ず残す
+        while cut < len(turns) - 1 and total + self.tokens(summary) > budget:
+            total -= sizes[cut]
+            text = self._line(turns[cut])
+            lines.append((text, self.count(text) + 1))
+            line_tokens += lines[-1][1]
+            while lines and line_tokens > self.summary_tokens:
+                line_tokens -= lines.popleft()[1]
+            summary = [self._summary(lines)]
+            cut += 1
+        # 要約そのものが大きすぎる場合は古い行から捨てる
+        while summary and total + self.tokens(summary) > budget:
+            if lines:
+                lines.popleft()
+            summary = [self._summary(lines)] if lines else []
+
+        messages = head + summary + turns[cut:] + tail
+        return messages, self.tokens(messages), cut
@@ -0,0 +1,63 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class DiskCache:
+    """SQLite に保存する、合計サイズ上限付きの LRU キャッシュ。
+
+    値は bytes。JSON で保存したい場合は get_json / set_json を使う。
+    プロセス内のスレッド間で共有でき、同じファイルを複数プロセスで開いてもよい。
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+            " size INTEGER NOT NULL, accessed REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def set(self, key: str, value: bytes):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed)"
+                " VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()))
+            # 新しく使われた順にサイズを積算し、上限を超えた分を捨てる
+            self._conn.execute(
+                "DELETE FROM entries WHERE key IN ("
+                " SELECT key FROM (SELECT key, SUM(size) OVER"
+                "  (ORDER BY accessed DESC) AS total FROM entries)"
+                " WHERE total > ?)", (self.max_bytes,))
+
+    def get_json(self, key: str):
+        value = self.get(key)
+        return None if value is None else json.loads(value)
+
+    def set_json(self, key: str, value):
+        self.set(key, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def keys(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT key FROM entries")]
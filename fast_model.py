@@ -0,0 +1,119 @@
+import numpy as np
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+
+class CompiledModel:
+    """Pipeline(preprocessor=ColumnTransformer, regressor=決定木/ランダムフォレスト) を
+    numpy 配列だけで推論するエンジン。
+
+    One-hot 化は辞書による出力位置の参照に、木はすべての木をつなげた
+    ノード配列に変換しておくので、DataFrame を作らずに dict のまま予測できる。
+    結果は model.predict と一致する。対応していない変換器があれば ValueError。
+    """
+
+    def __init__(self, model):
+        prep = model.named_steps["preprocessor"]
+        regressor = model.named_steps["regressor"]
+        self.columns = list(prep.feature_names_in_)
+        self.n_features = len(prep.get_feature_names_out())
+        self._compile_preprocessor(prep)
+        self._compile_trees(getattr(regressor, "estimators_", [regressor]))
+
+    def _compile_preprocessor(self, prep):
+        # 入力列名 -> {カテゴリ: 出力位置}
+        self._lookup = {}
+        num_cols, num_idx, mean, scale = [], [], [], []
+        for name, trans, columns in prep.transformers_:
+            if isinstance(trans, str) and trans == "drop":
+                continue
+            columns = list(columns)
+            if isinstance(columns[0], (int, np.integer)):
+                columns = [self.columns[i] for i in columns]
+            start = prep.output_indices_[name].start
+            if isinstance(trans, OneHotEncoder):
+                if trans.drop_idx_ is not None or trans._infrequent_enabled:
+                    raise ValueError("OneHotEncoder with drop / infrequent categories "
+                                     "is not supported")
+                if trans.handle_unknown != "ignore":
+                    raise ValueError("OneHotEncoder must use handle_unknown='ignore'")
+                for column, categories in zip(columns, trans.categories_):
+                    self._lookup[column] = {c: start + k for k, c in enumerate(categories)}
+                    start += len(categories)
+            elif isinstance(trans, StandardScaler) or trans == "passthrough":
+                n = len(columns)
+                with_mean = isinstance(trans, StandardScaler) and trans.with_mean
+                with_std = isinstance(trans, StandardScaler) and trans.with_std
+                num_cols += columns
+                num_idx += range(start, start + n)
+                mean += list(trans.mean_) if with_mean else [0.0] * n
+                scale += list(trans.scale_) if with_std else [1.0] * n
+            else:
+                raise ValueError(f"Unsupported transformer: {trans!r}")
+        self._num_cols = num_cols
+        self._num_idx = np.array(num_idx, dtype=np.intp)
+        self._mean = np.array(mean, dtype=np.float64)
+        self._scale = np.array(scale, dtype=np.float64)
+
+    def _compile_trees(self, estimators):
+        left, right, feature, threshold, missing_left, value = [], [], [], [], [], []
+        roots = []
+        offset = 0
+        for est in estimators:
+            tree = est.tree_
+            if tree.n_outputs != 1:
+                raise ValueError("Only single-output regressors are supported")
+            n = tree.node_count
+            idx = np.arange(offset, offset + n)
+            is_leaf = tree.children_left < 0
+            # 葉は自分自身を指すようにして、木の深さだけ回せば全行が葉に着くようにする
+            left.append(np.where(is_leaf, idx, tree.children_left + offset))
+            right.append(np.where(is_leaf, idx, tree.children_right + offset))
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(tree.threshold)
+            missing_left.append(getattr(tree, "missing_go_to_left",
+                                        np.zeros(n, dtype=np.uint8)).astype(bool))
+            value.append(tree.value[:, 0, 0])
+            roots.append(offset)
+            offset += n
+        self._left = np.concatenate(left).astype(np.intp)
+        self._right = np.concatenate(right).astype(np.intp)
+        self._feature = np.concatenate(feature).astype(np.intp)
+        self._threshold = np.concatenate(threshold).astype(np.float64)
+        self._missing_left = np.concatenate(missing_left)
+        self._value = np.concatenate(value).astype(np.float64)
+        self._roots = np.array(roots, dtype=np.intp)
+        self._depth = max(est.tree_.max_depth for est in estimators)
+
+    def transform(self, records):
+        """dict のリストを前処理後の特徴量行列にする（preprocessor.transform 相当）。"""
+        X = np.zeros((len(records), self.n_features), dtype=np.float64)
+        for i, record in enumerate(records):
+            for column, table in self._lookup.items():
+                j = table.get(record.get(column))
+                if j is not None:
+                    X[i, j] = 1.0
+        num = np.array([[record[c] for c in self._num_cols] for record in records],
+                       dtype=np.float64).reshape(len(records), len(self._num_cols))
+        X[:, self._num_idx] = (num - self._mean) / self._scale
+        return X
+
+    def predict_matrix(self, X):
+        # sklearn の木と同じく float32 にしてから float64 のしきい値と比べる
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))[:, None]
+        node = np.repeat(self._roots[None, :], len(X), axis=0)
+        for _ in range(self._depth):
+            x = X[rows, self._feature[node]]
+            go_left = np.where(np.isnan(x), self._missing_left[node],
+                               x <= self._threshold[node])
+            node = np.where(go_left, self._left[node], self._right[node])
+        # 木の順に足してから割る（RandomForestRegressor.predict と同じ順序）
+        return self._value[node.T].sum(axis=0) / len(self._roots)
+
+    def predict(self, records):
+        if isinstance(records, dict):
+            records = [records]
+        return self.predict_matrix(self.transform(records))
+
+    def predict_one(self, record) -> float:
+        return float(self.predict([record])[0])
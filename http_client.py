@@ -0,0 +1,138 @@
+"""外部 API 呼び出し用の共有 HTTP クライアント。
+
+プロセスで1つの requests.Session を使い回し、ホストごとの keep-alive
+コネクションプールと、統一したタイムアウト・再試行を提供する。
+再試行は冪等なメソッド（GET / HEAD / OPTIONS）だけに自動で行う。
+"""
+import functools
+import random
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+# (接続, 読み込み) のタイムアウト（秒）
+DEFAULT_TIMEOUT = (5, 30)
+# ホストごとに保持するコネクション数
+POOL_SIZE = 16
+_POOL_HOSTS = 8
+
+
+class _JitterRetry(Retry):
+    # 指数バックオフに揺らぎを入れて、再試行が同時に集中しないようにする
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff else 0
+
+
+def _make_session():
+    retry = _JitterRetry(
+        total=3, backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+        raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=_POOL_HOSTS, pool_maxsize=POOL_SIZE,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _make_session()
+    return _session
+
+
+def request(method: str, url: str, *, timeout=DEFAULT_TIMEOUT, **kwargs):
+    # ホストごとに時間・エラー・送受信サイズを記録する
+    with metrics.timed(f"http.{method} {urlsplit(url).hostname}") as timer:
+        data = kwargs.get("data")
+        if isinstance(data, (bytes, bytearray)):
+            timer.add_size(len(data))
+        resp = get_session().request(method, url, timeout=timeout, **kwargs)
+        timer.add_size(int(resp.headers.get("content-length") or 0))
+        if resp.status_code >= 500:
+            timer.mark_error()
+    return resp
+
+
+def get(url: str, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def resolve_redirect(url: str, *, timeout=DEFAULT_TIMEOUT) -> str:
+    """本文をダウンロードせずに、リダイレクトをたどった先の URL を返す。"""
+    resp = request("HEAD", url, timeout=timeout, allow_redirects=True)
+    if resp.status_code not in (405, 501):
+        return resp.url
+    # HEAD を受け付けないサーバーにはヘッダだけ読んで接続を閉じる
+    with request("GET", url, timeout=timeout, stream=True) as resp:
+        return resp.url
+
+
+class TTLCache:
+    """件数上限と有効期限つきの LRU キャッシュ。スレッド間で共有してよい。"""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+def ttl_cache(maxsize: int = 256, ttl: float = 3600):
+    """引数ごとに結果を TTLCache に覚えておくデコレータ。"""
+    def decorator(fn):
+        cache = TTLCache(maxsize, ttl)
+        missing = object()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            value = cache.get(key, missing)
+            if value is missing:
+                value = fn(*args, **kwargs)
+                cache.set(key, value)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
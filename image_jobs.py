@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import http_client
+import metrics
+from image_response import decode_response, is_image
+
+API_BASE = os.environ.get("HF_API_BASE", "https://api-inference.huggingface.co/models")
+# モデルのロード待ちを含めて、1件の生成にかける最大時間（秒）
+MAX_WAIT = 300
+# (接続, 読み込み) のタイムアウト（秒）
+_REQUEST_TIMEOUT = (5, 60)
+_MAX_BACKOFF = 30
+# 終わったジョブはこの時間（秒）だけ状態を残す
+_JOB_TTL = 3600
+
+
+def cache_key(model: str, prompt: str, params: dict = None) -> str:
+    key = json.dumps({"model": model, "prompt": prompt, "params": params or {}},
+                     sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class RateLimiter:
+    """1秒あたり rate 回までにリクエストを抑えるトークンバケット。"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # 足りなければ先に予約しておき、その分だけ待つ
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+class Job:
+    """画像生成ジョブの状態。ページからはこれを見て表示を更新する。"""
+
+    def __init__(self, model, prompt, params, key):
+        self.id = uuid.uuid4().hex
+        self.model = model
+        self.prompt = prompt
+        self.params = params
+        self.key = key
+        self.status = "queued"  # queued / loading / running / done / error
+        self.image = None
+        self.error = None
+        self.response = None
+        self.cached = False
+        self.attempts = 0
+        self.eta = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def _finish(self, status, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+        self.status = status
+        self.finished_at = time.time()
+
+
+class JobQueue:
+    """画像生成をバックグラウンドで行うキュー。
+
+    モデルがロード中（503 と estimated_time）のときは待ち時間に従って再試行し、
+    生成した画像は (モデル, プロンプト, パラメータ) をキーに cache へ保存する。
+    同じ内容のジョブが実行中なら新しく送らずにそれを返す。
+    """
+
+    def __init__(self, cache, max_workers: int = 4, max_wait: float = MAX_WAIT,
+                 limiter: RateLimiter = None):
+        self.cache = cache
+        self.max_wait = max_wait
+        self.limiter = limiter
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, model: str, prompt: str, params: dict = None,
+               token: str = None) -> Job:
+        key = cache_key(model, prompt, params)
+        with self._lock:
+            self._purge()
+            for job in self._jobs.values():
+                if job.key == key and not job.finished:
+                    return job
+            job = Job(model, prompt, params, key)
+            self._jobs[job.id] = job
+        image = self.cache.get(key)
+        if is_image(image):
+            job._finish("done", image=image, cached=True)
+            return job
+        self._pool.submit(self._run, job, token)
+        return job
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _purge(self):
+        now = time.time()
+        for job_id in [i for i, job in self._jobs.items()
+                       if job.finished and now - job.finished_at > _JOB_TTL]:
+            del self._jobs[job_id]
+
+    def _run(self, job: Job, token: str):
+        with metrics.timed("image.job") as timer:
+            try:
+                self._generate(job, token)
+            except Exception as e:
+                # 例外はスレッドプールに捨てられるので、ここでジョブを終わらせる。
+                # そうしないとページが running のまま待ち続ける
+                job._finish("error", error=f"画像生成中にエラーが発生しました: {e!r}")
+            if job.status == "error":
+                timer.mark_error()
+
+    def _generate(self, job: Job, token: str):
+        url = f"{API_BASE}/{job.model}"
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        payload = {"inputs": job.prompt}
+        if job.params:
+            payload["parameters"] = job.params
+        deadline = time.monotonic() + self.max_wait
+        backoff = 1.0
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire()
+            job.attempts += 1
+            job.status = "running"
+            job.eta = None
+            try:
+                resp = http_client.post(url, headers=headers, json=payload,
+                                        timeout=_REQUEST_TIMEOUT)
+            except requests.RequestException as e:
+                decoded = None
+                error = f"APIリクエストでエラーが発生しました: {e}"
+            else:
+                decoded = decode_response(resp)
+                # 画像でないバイト列をキャッシュすると、同じプロンプトで毎回返してしまう
+                if is_image(decoded.image):
+                    self.cache.set(job.key, decoded.image)
+                    job._finish("done", image=decoded.image)
+                    return
+                body = decoded.payload if isinstance(decoded.payload, dict) else {}
+                error = body.get("error") or body.get("error_message") or \
+                    f"APIレスポンスが画像ではありませんでした（ステータス {decoded.status_code}）"
+                if decoded.status_code < 500:
+                    job._finish("error", error=error, response=decoded)
+                    return
+
+            # 5xx や通信エラーは待ってから再試行する。ロード中なら推定時間だけ待つ
+            wait = backoff + random.uniform(0, backoff)
+            estimated = body.get("estimated_time") if decoded is not None else None
+            if isinstance(estimated, (int, float)):
+                wait = max(float(estimated), 1.0)
+            else:
+                estimated = None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                job._finish("error", error=error, response=decoded)
+                return
+            wait = min(wait, remaining)
+            job.status = "loading" if estimated is not None else "queued"
+            job.eta = time.time() + wait
+            time.sleep(wait)
+            backoff = min(backoff * 2, _MAX_BACKOFF)
@@ -0,0 +1,81 @@
+import io
+import threading
+from collections import defaultdict
+
+from PIL import Image, ImageOps
+
+# ラベル検出は 640x480 程度あれば十分（Vision API の推奨サイズ）
+MAX_SIDE = 640
+JPEG_QUALITY = 85
+
+
+def dhash(img: Image.Image, size: int = 8) -> int:
+    """差分ハッシュ（dHash）。再圧縮や縮小をしても値がほとんど変わらない。"""
+    gray = img.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left < right)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class HashIndex:
+    """dHash の近傍検索用の索引。
+
+    64 ビットを max_distance + 1 個の帯に分けて帯ごとに引く。距離が
+    max_distance 以下なら少なくとも1つの帯は完全に一致するので、候補だけを
+    比べればよい。
+    """
+
+    def __init__(self, hashes=(), max_distance: int = 4, bits: int = 64):
+        self.max_distance = max_distance
+        n = max_distance + 1
+        edges = [bits * i // n for i in range(n + 1)]
+        self._bands = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]
+        self._tables = [defaultdict(set) for _ in self._bands]
+        self._lock = threading.Lock()
+        for h in hashes:
+            self.add(h)
+
+    def add(self, h: int):
+        with self._lock:
+            for (shift, mask), table in zip(self._bands, self._tables):
+                table[(h >> shift) & mask].add(h)
+
+    def discard(self, h: int):
+        with self._lock:
+            for (shift, mask), table in zip(self._bands, self._tables):
+                table[(h >> shift) & mask].discard(h)
+
+    def nearest(self, h: int):
+        """距離が max_distance 以下で最も近いハッシュを返す（なければ None）。"""
+        with self._lock:
+            candidates = set()
+            for (shift, mask), table in zip(self._bands, self._tables):
+                candidates |= table.get((h >> shift) & mask, set())
+        best = None
+        best_distance = self.max_distance + 1
+        for c in candidates:
+            d = hamming(c, h)
+            if d < best_distance:
+                best, best_distance = c, d
+        return best
+
+
+def prepare_image(content: bytes, max_side: int = MAX_SIDE):
+    """画像を縮小して JPEG に再エンコードし、(バイト列, dHash) を返す。"""
+    img = Image.open(io.BytesIO(content))
+    # JPEG は縮小した解像度で直接デコードさせる
+    img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((max_side, max_side))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return buf.getvalue(), dhash(img)
@@ -0,0 +1,110 @@
+import binascii
+import json
+import re
+from typing import NamedTuple
+
+# これより大きい JSON は全体をパースせず、最初の画像フィールドを探す
+_SMALL_JSON_BYTES = 64 * 1024
+_JSON_START_RE = re.compile(rb"\s*[{\[]")
+_BASE64_RE = re.compile(r"[A-Za-z0-9+/=\n\r]+")
+# JSON 文字列としての data URL、または十分に長い base64 文字列
+_IMAGE_FIELD_RE = re.compile(
+    rb'"(?:data:image/[\w.+-]+;base64,)?([A-Za-z0-9+/=\\]{100,})"')
+_JSON_ESCAPE_RE = re.compile(rb"\\[nr]?")
+# 画像として扱う形式の先頭バイト
+_IMAGE_MAGIC = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF87a", b"GIF89a")
+
+
+class DecodedResponse(NamedTuple):
+    status_code: int
+    content_type: str
+    body: bytes
+    is_json: bool
+    payload: object
+    image: bytes
+
+    @property
+    def text(self):
+        return self.body.decode("utf-8", errors="replace")
+
+
+def decode_base64(data):
+    """base64（bytes / str）を C 実装でデコードする。失敗したら None。"""
+    try:
+        return binascii.a2b_base64(data)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def is_image(data):
+    """PNG / JPEG / GIF / WebP の先頭バイトで始まっていれば True。"""
+    if not data:
+        return False
+    return data.startswith(_IMAGE_MAGIC) or (data[:4] == b"RIFF" and data[8:12] == b"WEBP")
+
+
+def find_base64_image(body):
+    """JSON 本文を先頭から走査し、最初に見つかった base64 画像をデコードする。
+
+    ID など画像でない長い文字列は、デコードして先頭バイトを確かめて読み飛ばす。
+    """
+    for m in _IMAGE_FIELD_RE.finditer(body):
+        data = memoryview(body)[m.start(1):m.end(1)]
+        if body.find(b"\\", m.start(1), m.end(1)) != -1:
+            # JSON のエスケープ（改行 \n や \/）を取り除く
+            data = _JSON_ESCAPE_RE.sub(b"", data)
+        image = decode_base64(data)
+        if is_image(image):
+            return image
+    return None
+
+
+def decode_response(resp):
+    """レスポンス本文を1回だけ読み、画像バイト列と JSON を取り出す。"""
+    body = resp.content
+    content_type = resp.headers.get("content-type", "")
+    is_json = False
+    payload = None
+    image = None
+    if content_type.startswith("image/"):
+        image = body
+    elif "application/json" in content_type or _JSON_START_RE.match(body):
+        is_json = True
+        if len(body) > _SMALL_JSON_BYTES:
+            image = find_base64_image(body)
+        if image is None:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                payload = None
+            else:
+                image = extract_base64_bytes(payload)
+    return DecodedResponse(resp.status_code, content_type, body, is_json,
+                           payload, image)
+
+
+def extract_base64_bytes(obj):
+    """再帰的にpayloadから base64 エンコードされた画像を見つけてbytesで返す（見つからなければNone）。"""
+    if isinstance(obj, str):
+        s = obj.strip()
+        # data:image/...;base64,... 形式
+        if s.startswith("data:image/") and "," in s:
+            _prefix, b64 = s.split(",", 1)
+            b = decode_base64(b64)
+            return b if is_image(b) else None
+        # 直接base64文字列（長さで判定し、デコード結果の先頭バイトを確かめる）
+        if len(s) > 100 and _BASE64_RE.fullmatch(s):
+            b = decode_base64(s)
+            return b if is_image(b) else None
+        return None
+    if isinstance(obj, list):
+        for v in obj:
+            b = extract_base64_bytes(v)
+            if b:
+                return b
+    if isinstance(obj, dict):
+        for v in obj.values():
+            b = extract_base64_bytes(v)
+            if b:
+                return b
+    return None
@@ -2,3 +2,5 @@ import streamlit as st
 
 st.title("My Streamlit App")
 st.write("Hello, world!")
+
+st.page_link("pages/performance.py", label="パフォーマンスの計測結果", icon="📊")
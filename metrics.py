@@ -0,0 +1,186 @@
+"""処理時間・エラー数・データサイズを記録する軽量な計測 API。
+
+    with metrics.timed("stt.recognize"):
+        ...
+
+    @metrics.timed("ml.load_model")
+    def load_model():
+        ...
+
+値はプロセス内に保持し、名前ごとに直近の計測値からパーセンタイルを計算する。
+"""
+import functools
+import threading
+import time
+from collections import deque
+
+# 名前ごとに保持する直近の計測値の数
+SAMPLE_SIZE = 2048
+
+
+class _Metric:
+    __slots__ = ("count", "errors", "total", "bytes", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.bytes = 0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+
+_metrics = {}
+# 時間を測らない回数だけのカウンタ。パーセンタイルの表には入れない
+_counters = {}
+_lock = threading.Lock()
+
+
+def observe(name: str, seconds: float, *, error: bool = False, size: int = None):
+    with _lock:
+        m = _metrics.get(name)
+        if m is None:
+            m = _metrics[name] = _Metric()
+        m.count += 1
+        m.total += seconds
+        m.samples.append(seconds)
+        if error:
+            m.errors += 1
+        if size:
+            m.bytes += size
+
+
+def count(name: str, n: int = 1):
+    """時間を測らずに回数だけ数える（キャッシュのヒット数など）。"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+class timed:
+    """with 文でもデコレータでも使えるタイマー。例外が出たらエラーとして数える。
+
+    計測中に分かったデータサイズは add_size で足せる。例外にならない失敗
+    （エラーレスポンスなど）は mark_error で数える。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.size = 0
+        self.failed = False
+
+    def add_size(self, nbytes: int):
+        self.size += nbytes or 0
+
+    def mark_error(self):
+        self.failed = True
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self._start,
+                error=exc_type is not None or self.failed, size=self.size)
+        return False
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # 呼び出しごとに別のタイマーを使う（スレッド間で共有しない）
+            with timed(self.name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+def _quantile(sorted_samples, q):
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(int(q * len(sorted_samples)), len(sorted_samples) - 1)]
+
+
+def snapshot():
+    """名前ごとの集計値のリストを返す。"""
+    with _lock:
+        items = [(name, m.count, m.errors, m.total, m.bytes, sorted(m.samples))
+                 for name, m in sorted(_metrics.items())]
+    return [{
+        "name": name,
+        "count": count,
+        "errors": errors,
+        "p50_ms": _quantile(samples, 0.5) * 1000,
+        "p95_ms": _quantile(samples, 0.95) * 1000,
+        "p99_ms": _quantile(samples, 0.99) * 1000,
+        "mean_ms": total / count * 1000 if count else 0.0,
+        "bytes": nbytes,
+    } for name, count, errors, total, nbytes, samples in items]
+
+
+def counters():
+    """count() で数えた回数を名前順の {名前: 回数} で返す。"""
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+
+def export() -> dict:
+    """計測値をそのまま（直近の計測値も含めて）辞書で返す。
+
+    別プロセスで測った値を merge で1つにまとめるために使う。
+    """
+    with _lock:
+        return {
+            "metrics": {name: {"count": m.count, "errors": m.errors, "total": m.total,
+                               "bytes": m.bytes, "samples": list(m.samples)}
+                        for name, m in _metrics.items()},
+            "counters": dict(_counters),
+        }
+
+
+def merge(data: dict):
+    """export の結果をこのプロセスの計測値に足し込む。"""
+    with _lock:
+        for name, d in data["metrics"].items():
+            m = _metrics.get(name)
+            if m is None:
+                m = _metrics[name] = _Metric()
+            m.count += d["count"]
+            m.errors += d["errors"]
+            m.total += d["total"]
+            m.bytes += d["bytes"]
+            m.samples.extend(d["samples"])
+        for name, n in data["counters"].items():
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def reset():
+    with _lock:
+        _metrics.clear()
+        _counters.clear()
+
+
+def _label(name):
+    return name.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text(prefix: str = "app") -> str:
+    """Prometheus のテキスト形式で書き出す。"""
+    lines = [f"# TYPE {prefix}_duration_seconds summary"]
+    rows = snapshot()
+    for row in rows:
+        label = _label(row["name"])
+        for q, key in ((0.5, "p50_ms"), (0.95, "p95_ms"), (0.99, "p99_ms")):
+            lines.append(f'{prefix}_duration_seconds{{name="{label}",quantile="{q}"}} '
+                         f'{row[key] / 1000:.6f}')
+        lines.append(f'{prefix}_duration_seconds_sum{{name="{label}"}} '
+                     f'{row["mean_ms"] * row["count"] / 1000:.6f}')
+        lines.append(f'{prefix}_duration_seconds_count{{name="{label}"}} {row["count"]}')
+    lines.append(f"# TYPE {prefix}_errors_total counter")
+    for row in rows:
+        label = _label(row["name"])
+        lines.append(f'{prefix}_errors_total{{name="{label}"}} {row["errors"]}')
+    lines.append(f"# TYPE {prefix}_payload_bytes_total counter")
+    for row in rows:
+        label = _label(row["name"])
+        lines.append(f'{prefix}_payload_bytes_total{{name="{label}"}} {row["bytes"]}')
+    lines.append(f"# TYPE {prefix}_events_total counter")
+    for name, n in counters().items():
+        lines.append(f'{prefix}_events_total{{name="{_label(name)}"}} {n}')
+    return "\n".join(lines) + "\n"
@@ -1,7 +1,17 @@
-import time
-
 import streamlit as st
-from util import encode_audio, get_response, extract_words
+from disk_cache import DiskCache
+from subtitles import Timeline
+from util import load_audio, normalize_audio, transcribe, transcript_key
+
+TRANSCRIPT_CACHE_PATH = "./.cache/transcripts.sqlite3"
+TRANSCRIPT_CACHE_BYTES = 64 * 1024 * 1024
+
+
+@st.cache_resource
+def get_transcript_cache():
+    return DiskCache(TRANSCRIPT_CACHE_PATH, max_bytes=TRANSCRIPT_CACHE_BYTES)
+
+
 st.markdown("## 字幕再生アプリ")
 
 if "words" not in st.session_state:
@@ -19,27 +29,39 @@ elif method == 'ファイルアップロード':
         audio_bytes = uploaded_file.read()
 
 if audio_bytes and st.button("upload"):
-    encoded_audio = encode_audio(audio_bytes)
-    resp = get_response(
-        # encoded_audio, sa_info=st.secrets.get('google_credentials'))
-        encoded_audio=encoded_audio, api_key=st.secrets.get('gcp_key'))
-    data = resp.json()
-    if "results" in data:
-        st.session_state["words"] = extract_words(data)
+    seg = normalize_audio(load_audio(audio_bytes))
+    cache = get_transcript_cache()
+    key = transcript_key(seg)
+    words = cache.get_json(key)
+    if words is None:
+        try:
+            with st.spinner("音声を認識中..."):
+                words = transcribe(
+                    # seg, sa_info=st.secrets.get('google_credentials'))
+                    seg, api_key=st.secrets.get('gcp_key'))
+        except RuntimeError as e:
+            st.error(f"音声認識でエラーが発生しました: {e}")
+        else:
+            if words:
+                cache.set_json(key, words)
+    if words:
+        st.session_state["words"] = words
         st.success("字幕データを取得しました")
-    else:
+    elif words is not None:
         st.warning('結果が空でした。音声の長さ、形式を確認してください。')
 
 if st.session_state["words"] is not None and st.toggle('再生'):
-    st.audio(audio_bytes, format='audio/wav', autoplay=True)
     if st.session_state["words"]:
-        offset = 0.0
-        subtitle = ""
-        subtitle_placeholder = st.empty()
-        for w in st.session_state["words"]:
-            time.sleep(max(0.0, w["startTime"] - offset))
-            subtitle += w["word"] + " "
-            subtitle_placeholder.markdown(subtitle)
-            offset = w["startTime"]
+        # 表示タイミングはブラウザのプレイヤーに任せる
+        timeline = Timeline.from_words(st.session_state["words"])
+        vtt = timeline.to_webvtt()
+        st.video(audio_bytes, format='audio/wav', autoplay=True,
+                 subtitles={"日本語": vtt})
+        col1, col2 = st.columns(2)
+        col1.download_button("WebVTT をダウンロード", vtt,
+                             file_name="subtitles.vtt", mime="text/vtt")
+        col2.download_button("SRT をダウンロード", timeline.to_srt(),
+                             file_name="subtitles.srt", mime="application/x-subrip")
     else:
+        st.audio(audio_bytes, format='audio/wav', autoplay=True)
         st.write('字幕データがありません。')
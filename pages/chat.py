@@ -1,10 +1,23 @@
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
-from huggingface_hub import InferenceClient
-from huggingface_hub.utils import RepositoryNotFoundError, HfHubHTTPError
+
+import metrics
+from conversation import ContextBudget
 
 MODEL = "google/gemma-2-2b-it"
-API_TOKEN = st.secrets["hugging_face_token"]
-client = InferenceClient(model=MODEL, token=API_TOKEN)
+# 設定するとモデル名の代わりにこの URL のエンドポイントへ送る
+CHAT_ENDPOINT = os.environ.get("HF_CHAT_ENDPOINT")
+# gemma-2 のコンテキスト長。応答用の max_tokens 分は空けておく
+MAX_CONTEXT_TOKENS = 8192
+REPLY_MAX_TOKENS = 150
+EVAL_MAX_TOKENS = 500
+# 返事と評価はそれぞれ自分の max_tokens 分を空けて予算を組む
+reply_budget = ContextBudget(MAX_CONTEXT_TOKENS, reserve=REPLY_MAX_TOKENS)
+eval_budget = ContextBudget(MAX_CONTEXT_TOKENS, reserve=EVAL_MAX_TOKENS)
 
 system_message_init = """あなたは雷で怖がっている保育園にいる子供、田中ゆずき5歳です。会話の相手は保育
 士です。"""
@@ -39,27 +52,136 @@ if "log" not in st.session_state:
 
 for post in st.session_state["log"]:
     if post["role"] != "system":
-        with st.chat_message(post["role"]):
+        avatar = "📝" if post.get("kind") == "eval" else None
+        with st.chat_message(post["role"], avatar=avatar):
             st.write(post["content"])
 
+
+def eval_messages(conversation):
+    """評価用のリクエスト。会話を1つの文字起こしにまとめ、評価の指示を添える。
+
+    評価の指示と応答の分も含めて eval_budget に収まるよう、古い発言は要約する。
+    """
+    posts = conversation[:1]
+    for post in conversation[1:]:
+        content = post["content"]
+        if post["role"] == "user" and not content.startswith("（保育士）"):
+            content = f"（保育士）{content}"
+        posts.append({"role": post["role"], "content": content})
+    context, _, _ = eval_budget.build(
+        posts, pinned=1 + len(initial_conversation), instruction=system_message_eval)
+    # 先頭のペルソナ設定と末尾の指示は除き、要約を含む残りの発言を並べる
+    lines = [post["content"] for post in context[1:-1]]
+    return [{"role": "system", "content": system_message_init},
+            {"role": "user", "content": "\n".join(lines) + "\n\n" + system_message_eval}]
+
+
+@st.cache_resource
+def get_client():
+    # huggingface_hub の読み込みとトークンの参照は最初に送信したときまで遅らせる
+    from huggingface_hub import InferenceClient
+    return InferenceClient(model=CHAT_ENDPOINT or MODEL,
+                           token=st.secrets["hugging_face_token"])
+
+
+def stream_completion(client, name, messages, max_tokens, events):
+    """別スレッドで補完をストリームし、(name, 種類, 値) を events に送る。
+
+    例外はスレッドの外に出ないので、通信エラーなども含めてすべて error として送る。
+    """
+    timer = metrics.timed(f"hf.chat.{name}")
+    start = time.perf_counter()
+    first = True
+    try:
+        with timer:
+            stream = client.chat.completions.create(
+                messages=messages, max_tokens=max_tokens, stream=True)
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first:
+                        metrics.observe(f"hf.chat.{name}.ttft", time.perf_counter() - start)
+                        first = False
+                    timer.add_size(len(delta.encode("utf-8")))
+                    events.put((name, "delta", delta))
+    except Exception as e:
+        events.put((name, "error", e))
+    finally:
+        events.put((name, "done", None))
+
+
 message = st.chat_input("あなたの言葉で、ゆずきちゃんを安心させてあげよう。")
 
 if message:
     st.session_state["log"].append({"role": "user", "content": message})
-    st.session_state["log"].append(
-        {"role": "system", "content": system_message_eval})
     with st.chat_message("user"):
         st.write(message)
-    try:
-        completion = client.chat.completions.create(
-            messages=st.session_state["log"],
-            max_tokens=500,
-
-        )
-        reply = completion.choices[0].message["content"]
-        st.session_state["log"].append({"role": "assistant", "content": reply})
-        with st.chat_message("assistant"):
-            st.write(reply)
-
-    except HfHubHTTPError:
-        st.warning("モデルのロードに失敗しました。しばらくしてからもう一度お試しください。")
+
+    # ゆずきの返事と評価は別々のリクエストにして並行に生成する
+    conversation = [m for m in st.session_state["log"]
+                    if m.get("kind") != "eval" and m["content"] != system_message_eval]
+    reply_context, reply_tokens, compacted = reply_budget.build(
+        conversation, pinned=1 + len(initial_conversation))
+    eval_context = eval_messages(conversation)
+    streams = {
+        "reply": {"messages": reply_context, "max_tokens": REPLY_MAX_TOKENS,
+                  "prompt_tokens": reply_tokens, "avatar": None},
+        "eval": {"messages": eval_context, "max_tokens": EVAL_MAX_TOKENS,
+                 "prompt_tokens": eval_budget.tokens(eval_context), "avatar": "📝"},
+    }
+    for name, job in streams.items():
+        with st.chat_message("assistant", avatar=job["avatar"]):
+            job["box"] = st.empty()
+            job["info"] = st.empty()
+        job.update(text="", tokens=0, first_token_at=None, error=None)
+
+    client = get_client()
+    events = queue.Queue()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(streams)) as pool:
+        for name, job in streams.items():
+            pool.submit(stream_completion, client, name, job["messages"],
+                        job["max_tokens"], events)
+        pending = len(streams)
+        while pending:
+            name, kind, value = events.get()
+            job = streams[name]
+            if kind == "delta":
+                if job["first_token_at"] is None:
+                    job["first_token_at"] = time.perf_counter()
+                job["tokens"] += 1
+                job["text"] += value
+                job["box"].markdown(job["text"] + "▌")
+            elif kind == "error":
+                job["error"] = value
+            else:
+                pending -= 1
+                job["done_at"] = time.perf_counter()
+                job["box"].markdown(job["text"])
+                with job["info"].container():
+                    if job["error"] is not None and job["text"]:
+                        st.warning("応答の途中でエラーが発生しました。ここまでの内容を表示しています。")
+                    elif job["error"] is not None:
+                        st.warning("応答を取得できませんでした。しばらくしてからもう一度お試しください。"
+                                   f"（{job['error']}）")
+                    caption = f"プロンプト 約{job['prompt_tokens']:,} トークン"
+                    if job["first_token_at"] is not None:
+                        # ストリームの1チャンクがおおよそ1トークン
+                        elapsed = job["done_at"] - job["first_token_at"]
+                        job["ttft"] = job["first_token_at"] - start
+                        job["tokens_per_sec"] = job["tokens"] / elapsed if elapsed > 0 else 0.0
+                        caption = (f"最初の応答まで {job['ttft']:.2f} 秒 / "
+                                   f"{job['tokens_per_sec']:.1f} トークン/秒 / " + caption)
+                    if name == "reply" and compacted:
+                        caption += f"（古い発言 {compacted} 件を要約）"
+                    st.caption(caption)
+
+    st.session_state.setdefault("stream_stats", []).append(
+        {name: {k: job.get(k) for k in ("ttft", "tokens", "tokens_per_sec", "prompt_tokens")}
+         for name, job in streams.items()})
+    if streams["reply"]["text"]:
+        st.session_state["log"].append(
+            {"role": "assistant", "content": streams["reply"]["text"]})
+    if streams["eval"]["text"]:
+        st.session_state["log"].append(
+            {"role": "assistant", "content": streams["eval"]["text"], "kind": "eval"})
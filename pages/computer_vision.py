@@ -1,46 +1,246 @@
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import streamlit as st
-from google.cloud import vision
+
+import metrics
+from disk_cache import DiskCache
+from image_prep import HashIndex, prepare_image
+
+# batch_annotate_images は 1 リクエスト 16 枚まで。サイズ上限にも余裕を持たせる
+BATCH_SIZE = 16
+BATCH_BYTES = 8 * 1024 * 1024
+MAX_WORKERS = 4
+# 設定すると REST でこのエンドポイント（例: http://127.0.0.1:8080）に認証なしで接続する
+VISION_ENDPOINT = os.environ.get("VISION_ENDPOINT")
+
+LABEL_CACHE_PATH = "./.cache/vision_labels.sqlite3"
+LABEL_CACHE_BYTES = 16 * 1024 * 1024
+# dHash の距離がこれ以下なら同じ画像とみなす
+HASH_DISTANCE = 4
+
+
+@st.cache_resource
+def get_client():
+    # google-cloud-vision は読み込みが重いので、解析するときまで遅らせる
+    from google.cloud import vision
+
+    if VISION_ENDPOINT:
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud.vision_v1.services.image_annotator.transports.rest import (
+            ImageAnnotatorRestTransport)
+
+        scheme, _, host = VISION_ENDPOINT.rpartition("://")
+        transport = ImageAnnotatorRestTransport(
+            host=host, url_scheme=scheme or "https", credentials=AnonymousCredentials())
+        return vision.ImageAnnotatorClient(transport=transport)
+    credentials_dict = json.loads(
+        st.secrets['google_credentials'], strict=False)
+    return vision.ImageAnnotatorClient.from_service_account_info(
+        info=credentials_dict)
+
+
+@st.cache_resource
+def get_label_cache():
+    return DiskCache(LABEL_CACHE_PATH, max_bytes=LABEL_CACHE_BYTES)
+
+
+@st.cache_resource
+def get_hash_index():
+    # キャッシュのキーはプロセスで1度だけ読み、以降は保存のたびに足していく
+    return HashIndex((int(key, 16) for key in get_label_cache().keys()),
+                     max_distance=HASH_DISTANCE)
+
+
+def find_cached(image_hash):
+    """dHash が一致するか最も近い画像の解析結果を返す（なければ None）。"""
+    cache = get_label_cache()
+    result = cache.get_json(f"{image_hash:016x}")
+    if result is not None:
+        return result
+    index = get_hash_index()
+    nearest = index.nearest(image_hash)
+    if nearest is None:
+        return None
+    result = cache.get_json(f"{nearest:016x}")
+    if result is None:
+        # 容量超過でキャッシュから追い出されていた
+        index.discard(nearest)
+    return result
+
+
+def to_result(response):
+    return {
+        "error": response.error.message,
+        "labels": [[label.description, label.score]
+                   for label in response.label_annotations],
+    }
+
+
+def store_result(image_hash, result):
+    if not result["error"]:
+        get_label_cache().set_json(f"{image_hash:016x}", result)
+        get_hash_index().add(image_hash)
+
+
+def safe_prepare(content):
+    """(prepare_image の結果, None) か、読めない画像なら (None, 例外) を返す。"""
+    try:
+        return prepare_image(content), None
+    except Exception as e:
+        # 壊れた画像（UnidentifiedImageError など）でバッチ全体を止めない
+        return None, e
 
 
-@st.cache_data
 def get_response(content):
     try:
-        credentials_dict = json.loads(
-            st.secrets['google_credentials'], strict=False)
-        client = vision.ImageAnnotatorClient.from_service_account_info(
-            info=credentials_dict)
-        image = vision.Image(content=content)
-        response = client.label_detection(image=image)
-        return response
+        with metrics.timed("vision.prepare_image") as timer:
+            timer.add_size(len(content))
+            prepared, error = safe_prepare(content)
+        if error is not None:
+            st.error(f"画像を読み込めませんでした: {error}")
+            return None
+        prepared, image_hash = prepared
+        result = find_cached(image_hash)
+        metrics.count("vision.cache_hit" if result else "vision.cache_miss")
+        if result is None:
+            from google.cloud import vision
+
+            client = get_client()
+            image = vision.Image(content=prepared)
+            with metrics.timed("vision.label_detection") as timer:
+                timer.add_size(len(prepared))
+                result = to_result(client.label_detection(image=image))
+                if result["error"]:
+                    timer.mark_error()
+            store_result(image_hash, result)
+        return result
     except KeyError:
         st.error("Google Cloud認証情報が設定されていません。Streamlit Cloudのsecretsに設定してください。")
         return None
 
 
+def make_batches(contents):
+    """画像のインデックスを、枚数とサイズの上限に収まるバッチに分ける。"""
+    batches = []
+    batch = []
+    size = 0
+    for i, content in enumerate(contents):
+        if batch and (len(batch) >= BATCH_SIZE or size + len(content) > BATCH_BYTES):
+            batches.append(batch)
+            batch = []
+            size = 0
+        batch.append(i)
+        size += len(content)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def annotate_batch(client, contents):
+    from google.cloud import vision
+
+    feature = vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION)
+    requests = [vision.AnnotateImageRequest(image=vision.Image(content=c),
+                                            features=[feature])
+                for c in contents]
+    with metrics.timed("vision.batch_annotate") as timer:
+        timer.add_size(sum(len(c) for c in contents))
+        return client.batch_annotate_images(requests=requests).responses
+
+
+def render_labels(result):
+    if result["error"]:
+        st.error(f'{result["error"]}\nfor more info on error messages, check: '
+                 'https://cloud.google.com/apis/design/errors')
+    else:
+        for description, score in result["labels"]:
+            st.write(f"{description}: {score:.2%}")
+
+
+def annotate_files(files):
+    """複数の画像をバッチに分けて並列に解析し、終わったものから表示する。"""
+    from google.api_core.exceptions import GoogleAPIError
+
+    try:
+        client = get_client()
+    except KeyError:
+        st.error("Google Cloud認証情報が設定されていません。Streamlit Cloudのsecretsに設定してください。")
+        return
+
+    contents = [f.getvalue() for f in files]
+    placeholders = [st.empty() for _ in files]
+    progress = st.progress(0.0, text=f"0 / {len(files)} 枚")
+    done = 0
+
+    def show(i, result=None, error=None):
+        nonlocal done
+        with placeholders[i].container():
+            st.markdown(f"**{files[i].name}**")
+            if prepared[i] is not None:
+                st.image(prepared[i][0], width=200)
+            if error is not None:
+                st.error(f"解析に失敗しました: {error}")
+            else:
+                render_labels(result)
+        done += 1
+        progress.progress(done / len(files), text=f"{done} / {len(files)} 枚")
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        with metrics.timed("vision.prepare_images") as timer:
+            timer.add_size(sum(len(c) for c in contents))
+            outcomes = list(pool.map(safe_prepare, contents))
+        prepared = [item for item, _ in outcomes]
+
+        # 同じ・よく似た画像は以前の結果を使い、残りだけを送る
+        misses = []
+        for i, (item, error) in enumerate(outcomes):
+            if error is not None:
+                show(i, error=error)
+                continue
+            result = find_cached(item[1])
+            if result is None:
+                misses.append(i)
+            else:
+                show(i, result)
+
+        batches = [[misses[j] for j in batch]
+                   for batch in make_batches([prepared[i][0] for i in misses])]
+        futures = {pool.submit(annotate_batch, client,
+                               [prepared[i][0] for i in batch]): batch
+                   for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                responses = future.result()
+            except GoogleAPIError as e:
+                for i in batch:
+                    show(i, error=e)
+                continue
+            for i, response in zip(batch, responses):
+                result = to_result(response)
+                store_result(prepared[i][1], result)
+                show(i, result)
+
+
 st.markdown("# 画像認識アプリ")
 
-file = st.file_uploader("画像をアップロードしてください", type=["png", "jpg", "jpeg"])
-content = None
+files = st.file_uploader("画像をアップロードしてください", type=["png", "jpg", "jpeg"],
+                         accept_multiple_files=True)
 
-if file is not None:
-    content = file.getvalue()
+if len(files) == 1:
+    content = files[0].getvalue()
     st.image(content)
 
     if st.button('解析をする'):
-        if content is not None:
-            response = get_response(content)
-            if response is not None:
-                labels = response.label_annotations
-                st.write('Labels:')
-
-                if response.error.message:
-                    st.error(f'{response.error.message}\nfor more info on error messages, check: '
-                             'https://cloud.google.com/apis/design/errors')
-                else:
-                    for label in labels:
-                        st.write(f"{label.description}: {label.score:.2%}")
-        else:
-            st.warning("画像をアップロードしてから解析ボタンを押してください。")
+        result = get_response(content)
+        if result is not None:
+            st.write('Labels:')
+            render_labels(result)
+elif files:
+    st.write(f"{len(files)} 枚の画像が選択されています。")
+    if st.button('まとめて解析をする'):
+        annotate_files(files)
 else:
     st.info("画像をアップロードしてください。")
@@ -1,21 +1,41 @@
 import io
-import base64
-import requests
+import time
+import zipfile
+
 import streamlit as st
 
+from disk_cache import DiskCache
+from image_jobs import JobQueue, RateLimiter
+
+MODEL = "black-forest-labs/FLUX.1-dev"
+IMAGE_CACHE_PATH = "./.cache/generated_images.sqlite3"
+IMAGE_CACHE_BYTES = 256 * 1024 * 1024
+
+_STATUS_TEXT = {
+    "queued": "順番待ちです...",
+    "running": "画像を生成しています...",
+    "loading": "モデルを起動しています...",
+}
+
+
+@st.cache_resource
+def get_image_cache():
+    return DiskCache(IMAGE_CACHE_PATH, max_bytes=IMAGE_CACHE_BYTES)
+
 
-def render_error_response(resp):
+@st.cache_resource
+def get_job_queue():
+    return JobQueue(get_image_cache())
+
+
+def render_error_response(decoded):
     """補助: レスポンスの内容を表示する"""
-    content_type = resp.headers.get("content-type", "")
-    st.write(f"Content-Type: {content_type}")
-    st.write(f"Status Code: {resp.status_code}")
-    if "application/json" in content_type or resp.text.strip().startswith("{"):
-        try:
-            st.json(resp.json())
-        except Exception:
-            st.code(resp.text)
+    st.write(f"Content-Type: {decoded.content_type}")
+    st.write(f"Status Code: {decoded.status_code}")
+    if decoded.payload is not None:
+        st.json(decoded.payload)
     else:
-        st.code(resp.text)
+        st.code(decoded.text)
 
 
 def try_display_image_from_bytes(bts):
@@ -23,55 +43,144 @@ def try_display_image_from_bytes(bts):
     try:
         from PIL import Image
 
-        buf = io.BytesIO(bts)
-        img = Image.open(buf)
+        img = Image.open(io.BytesIO(bts))
         img.verify()  # 画像が破損していないかチェック
-        buf.seek(0)
-        st.image(buf, use_column_width=True)
+        st.image(bts, use_container_width=True)
         return True
     except Exception as e:
         st.error(f"画像表示エラー: {e}")
         return False
 
 
-def extract_base64_bytes(obj):
-    """再帰的にpayloadから base64 エンコードされた画像を見つけてbytesで返す（見つからなければNone）。"""
-    if isinstance(obj, str):
-        s = obj.strip()
-        # data:image/...;base64,... 形式
-        if s.startswith("data:image/") and "," in s:
-            _prefix, b64 = s.split(",", 1)
-            try:
-                return base64.b64decode(b64)
-            except Exception:
-                return None
-        # 直接base64文字列（長さで判定）
-        if len(s) > 100 and all(c.isalnum() or c in "+/=\n\r" for c in s):
-            try:
-                return base64.b64decode(s)
-            except Exception:
-                return None
-        return None
-    if isinstance(obj, list):
-        for v in obj:
-            b = extract_base64_bytes(v)
-            if b:
-                return b
-    if isinstance(obj, dict):
-        for v in obj.values():
-            b = extract_base64_bytes(v)
-            if b:
-                return b
-    return None
+def render_job(job):
+    """終わったジョブの結果を表示する。"""
+    if job.status == "done":
+        if job.cached:
+            st.success("同じ条件で生成済みの画像を表示します。")
+        else:
+            st.success(f"画像を生成しました（試行 {job.attempts} 回）。")
+        if not try_display_image_from_bytes(job.image):
+            st.error("返ってきたデータが画像として認識できませんでした。APIのレスポンスを確認してください。")
+    else:
+        st.error(f"API エラー: {job.error}")
+        if job.response is not None:
+            render_error_response(job.response)
+
+
+@st.fragment(run_every=1.0)
+def poll_job(job_id):
+    """スクリプトを止めずにジョブの状態を確認し、終わったらページを更新する。"""
+    job = get_job_queue().get(job_id)
+    # status はワーカーが書き換えるので、1回だけ読んでその値で判断する
+    status = job.status if job is not None else None
+    if status not in _STATUS_TEXT:
+        st.rerun()
+    text = _STATUS_TEXT[status]
+    if job.eta is not None:
+        text += f"（あと約 {max(job.eta - time.time(), 0):.0f} 秒で再試行）"
+    st.info(text)
+
+
+def image_extension(data):
+    if data.startswith(b"\x89PNG"):
+        return "png"
+    if data.startswith(b"\xff\xd8"):
+        return "jpg"
+    if data[8:12] == b"WEBP":
+        return "webp"
+    return "bin"
+
+
+def make_archive(jobs):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for i, job in enumerate(jobs, 1):
+            if job.status == "done":
+                zf.writestr(f"{i:03d}.{image_extension(job.image)}", job.image)
+        zf.writestr("prompts.txt", "\n".join(
+            f"{i:03d}\t{job.status}\t{job.prompt}" for i, job in enumerate(jobs, 1)))
+    return buf.getvalue()
+
+
+def render_batch(jobs, columns=3):
+    """まとめて生成したジョブの状態と、できあがった画像を一覧表示する。"""
+    done = sum(job.finished for job in jobs)
+    st.progress(done / len(jobs), text=f"{done} / {len(jobs)} 件完了")
+    cols = st.columns(columns)
+    for i, job in enumerate(jobs):
+        with cols[i % columns]:
+            st.caption(f"{i + 1}. {job.prompt}")
+            status = job.status
+            if status == "done":
+                st.image(job.image, use_container_width=True)
+            elif status == "error":
+                st.error(job.error)
+            else:
+                st.info(_STATUS_TEXT[status])
+
+
+def batch_jobs():
+    batch = st.session_state["image_batch"]
+    return [batch["queue"].get(job_id) for job_id in batch["job_ids"]]
+
+
+@st.fragment(run_every=1.0)
+def poll_batch():
+    jobs = batch_jobs()
+    render_batch(jobs)
+    if all(job.finished for job in jobs):
+        # 全件そろったらページ全体を更新してポーリングを止める
+        st.rerun()
+
+
+def batch_mode(token):
+    text = st.text_area("プロンプト（1行に1つ）", height=150)
+    prompt_file = st.file_uploader("またはプロンプトのファイル（.txt）", type=["txt"])
+    col1, col2 = st.columns(2)
+    concurrency = col1.slider("同時リクエスト数", 1, 8, 3)
+    per_minute = col2.number_input("1分あたりの最大リクエスト数", 1, 600, 30)
+
+    if st.button("まとめて生成"):
+        lines = text.splitlines()
+        if prompt_file is not None:
+            lines += prompt_file.getvalue().decode("utf-8").splitlines()
+        prompts = [line.strip() for line in lines if line.strip()]
+        if not prompts:
+            st.warning("プロンプトを入力してください。")
+            return
+        if not token:
+            st.error(
+                "Hugging Face のトークンが設定されていません。secrets に `hugging_face_token` を追加してください。")
+            return
+        old = st.session_state.get("image_batch")
+        if old is not None:
+            old["queue"].shutdown()
+        queue = JobQueue(get_image_cache(), max_workers=concurrency,
+                         limiter=RateLimiter(per_minute / 60))
+        st.session_state["image_batch"] = {
+            "queue": queue,
+            "job_ids": [queue.submit(MODEL, p, token=token).id for p in prompts],
+        }
+
+    if "image_batch" not in st.session_state:
+        return
+    jobs = batch_jobs()
+    if all(job.finished for job in jobs):
+        st.session_state["image_batch"]["queue"].shutdown()
+        render_batch(jobs)
+        st.download_button("画像をまとめてダウンロード (zip)", make_archive(jobs),
+                           file_name="images.zip", mime="application/zip")
+    else:
+        poll_batch()
 
 
 def main():
     token = st.secrets.get("hugging_face_token")
-    model = "black-forest-labs/FLUX.1-dev"
-    API_URL = f"https://api-inference.huggingface.co/models/{model}"
-    headers = {"Authorization": f"Bearer {token}"} if token else {}
 
     st.title("Image generation (Hugging Face)")
+    if st.radio("モード", ["1枚ずつ", "まとめて"], horizontal=True) == "まとめて":
+        batch_mode(token)
+        return
     prompt = st.text_input("Enter your prompt here:")
 
     if st.button("Generate Image"):
@@ -82,63 +191,18 @@ def main():
             st.error(
                 "Hugging Face のトークンが設定されていません。secrets に `hugging_face_token` を追加してください。")
             return
-
-        st.info("APIリクエスト中...")
-        try:
-            resp = requests.post(API_URL, headers=headers, json={
-                                 "inputs": prompt}, timeout=60)
-        except requests.RequestException as e:
-            st.error(f"APIリクエストでエラーが発生しました: {e}")
-            return
-
-        st.write(f"レスポンスステータス: {resp.status_code}")
-        content_type = resp.headers.get("content-type", "")
-        st.write(f"Content-Type: {content_type}")
-
-        # 1) 直接画像バイナリが返る
-        if content_type.startswith("image/"):
-            st.success("画像バイナリが返されました。")
-            ok = try_display_image_from_bytes(resp.content)
-            if not ok:
-                st.error("返ってきたデータが画像として認識できませんでした。APIのレスポンスを確認してください。")
-                render_error_response(resp)
-            return
-
-        # 2) JSON が返る場合 — payloadの中にbase64画像がある可能性を探す
-        if "application/json" in content_type or resp.text.strip().startswith("{"):
-            try:
-                payload = resp.json()
-                st.write("JSONレスポンス:")
-                st.json(payload)
-            except Exception:
-                st.error("JSONレスポンスの解析に失敗しました。")
-                st.code(resp.text)
-                return
-
-            # エラーとして返っている場合
-            if isinstance(payload, dict) and ("error" in payload or "error_message" in payload):
-                msg = payload.get("error") or payload.get("error_message")
-                st.error(f"API エラー: {msg}")
-                return
-
-            # payload内にbase64画像が含まれているか探す
-            bts = extract_base64_bytes(payload)
-            if bts:
-                st.success("JSON内にbase64画像が見つかりました。")
-                ok = try_display_image_from_bytes(bts)
-                if not ok:
-                    st.error("payload内のbase64データが画像として認識できませんでした。")
-                    st.json(payload)
-                return
-
-            # 画像なしのJSON（メタ情報や失敗メッセージなど）
-            st.info("APIからJSONレスポンスが返されました（画像は含まれていない可能性があります）。")
-            st.json(payload)
-            return
-
-        # 3) その他（テキスト/HTML/エラーメッセージ）
-        st.error("APIレスポンスが画像ではありませんでした。下記レスポンスを確認してください。")
-        render_error_response(resp)
+        job = get_job_queue().submit(MODEL, prompt, token=token)
+        st.session_state["image_job"] = job.id
+
+    job_id = st.session_state.get("image_job")
+    job = get_job_queue().get(job_id) if job_id else None
+    if job is None:
+        return
+    st.caption(f"プロンプト: {job.prompt}")
+    if job.finished:
+        render_job(job)
+    else:
+        poll_job(job.id)
 
 
 if __name__ == "__main__":
@@ -1,41 +1,39 @@
+import io
+import time
+
+import numpy as np
 import streamlit as st
-import pickle
 import pandas as pd
 
+import metrics
+import model_store
+from fast_model import CompiledModel
+
 MODEL_PATH = "./assets/model.pkl"
+BATCH_CHUNK_ROWS = 20_000
+# 感度分析で動かす数値項目と、その範囲
+SENSITIVITY_RANGES = {
+    "Avg_Daily_Usage_Hours": (0.0, 12.0),
+    "Sleep_Hours_Per_Night": (3.0, 12.0),
+    "Age": (10, 60),
+    "Conflicts_Over_Social_Media": (0, 10),
+}
 
 
 @st.cache_resource
+@metrics.timed("ml.load_model")
 def load_model():
-    # Compatibility Unpickler: some sklearn versions use internal classes
-    # (e.g. _RemainderColsList) that may not exist in the current sklearn.
-    # Provide a placeholder class during unpickling so the model can be loaded.
-    class CompatUnpickler(pickle.Unpickler):
-        def find_class(self, module, name):
-            if module == "sklearn.compose._column_transformer" and name == "_RemainderColsList":
-                # Minimal placeholder compatible with unpickling. Instances of
-                # this class are not used directly by the app logic, so a
-                # lightweight stub is sufficient.
-                class _RemainderColsList:
-                    def __init__(self, *args, **kwargs):
-                        pass
-
-                    def __repr__(self):
-                        return "_RemainderColsList()"
-
-                return _RemainderColsList
-            return super().find_class(module, name)
-
-    with open(MODEL_PATH, "rb") as f:
-        try:
-            model = CompatUnpickler(f).load()
-        except Exception:
-            # If the compat unpickler fails for any reason, fall back to
-            # the normal pickle loader so the original exception is raised
-            # (useful for debugging other issues).
-            f.seek(0)
-            model = pickle.load(f)
-    return model
+    # 計測では pickle を直接読むのが一番速い（model_store を参照）
+    return model_store.load(MODEL_PATH)
+
+
+@st.cache_resource
+def load_engine():
+    # 1件ずつの予測は DataFrame を作らない配列版で行う（対応外のモデルなら None）
+    try:
+        return CompiledModel(load_model())
+    except ValueError:
+        return None
 
 
 if "done" not in st.session_state:
@@ -46,10 +44,91 @@ def toggle_done(value=True):
     st.session_state["done"] = value
 
 
+def timed_predict(model, features, name):
+    with metrics.timed(name) as timer:
+        timer.add_size(int(features.memory_usage(index=False).sum()))
+        return model.predict(features)
+
+
+def grid_axis(column, n):
+    low, high = SENSITIVITY_RANGES[column]
+    if isinstance(low, int):
+        return np.unique(np.linspace(low, high, n).round()).astype(int)
+    return np.linspace(low, high, n)
+
+
+@st.cache_data(max_entries=64)
+def sensitivity_grid(_model, record, colnames, x_col, y_col, nx=50, ny=25):
+    """record の2項目を格子状に動かし、全点を1回の predict でまとめて予測する。"""
+    gx, gy = np.meshgrid(grid_axis(x_col, nx), grid_axis(y_col, ny))
+    n = gx.size
+    grid = pd.DataFrame({c: [record[c]] * n for c in colnames}, columns=colnames)
+    grid[x_col] = gx.ravel()
+    grid[y_col] = gy.ravel()
+    return pd.DataFrame({x_col: grid[x_col], y_col: grid[y_col],
+                         "score": timed_predict(_model, grid, "ml.predict_grid")})
+
+
+def iter_chunks(file, chunk_rows=BATCH_CHUNK_ROWS):
+    """アップロードされた CSV / Parquet を (DataFrame, 進捗率) の組で少しずつ読む。"""
+    if file.name.lower().endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet を読むには pyarrow が必要です。")
+        parquet = pq.ParquetFile(file)
+        total = parquet.metadata.num_rows
+        read = 0
+        for batch in parquet.iter_batches(batch_size=chunk_rows):
+            read += batch.num_rows
+            yield batch.to_pandas(), read / max(total, 1)
+    else:
+        for chunk in pd.read_csv(file, chunksize=chunk_rows):
+            yield chunk, min(file.tell() / max(file.size, 1), 1.0)
+
+
+def validate_chunk(chunk, colnames, num_colnames):
+    """必要な列を取り出し、数値列を変換する。数値に変換できない行は予測対象外にする。"""
+    missing = [c for c in colnames if c not in chunk.columns]
+    if missing:
+        raise ValueError(f"必要な列がありません: {', '.join(missing)}")
+    features = chunk[list(colnames)].copy()
+    for c in num_colnames:
+        features[c] = pd.to_numeric(features[c], errors="coerce")
+    valid = features[num_colnames].notna().all(axis=1)
+    return features, valid
+
+
+def predict_file(model, file, colnames, num_colnames):
+    """ファイルをチャンクごとに検証・予測し、予測列を足した CSV を返す。"""
+    progress = st.progress(0.0, text="予測中...")
+    output = io.StringIO()
+    rows = 0
+    skipped = 0
+    start = time.perf_counter()
+    for i, (chunk, fraction) in enumerate(iter_chunks(file)):
+        features, valid = validate_chunk(chunk, colnames, num_colnames)
+        chunk = chunk.assign(prediction=float("nan"))
+        if valid.any():
+            chunk.loc[valid, "prediction"] = timed_predict(
+                model, features[valid], "ml.predict_batch")
+        chunk.to_csv(output, header=(i == 0), index=False)
+        rows += len(chunk)
+        skipped += int((~valid).sum())
+        elapsed = time.perf_counter() - start
+        progress.progress(
+            fraction, text=f"{rows:,} 行 ({rows / max(elapsed, 1e-9):,.0f} 行/秒)")
+    elapsed = time.perf_counter() - start
+    progress.progress(1.0, text=f"{rows:,} 行を {elapsed:.1f} 秒で予測しました "
+                                f"({rows / max(elapsed, 1e-9):,.0f} 行/秒)")
+    return output.getvalue(), rows, skipped
+
+
 st.markdown("# メンタルヘルススコアの見積もり")
 
 load_state = st.markdown("モデルをロード中...")
 model = load_model()
+engine = load_engine()
 load_state.markdown("")
 
 prep = model.named_steps["preprocessor"]
@@ -115,8 +194,12 @@ if st.session_state["done"]:
               "Relationship_Status": relationship,
               "Conflicts_Over_Social_Media": conflicts
               }
-    features = pd.DataFrame([record], columns=colnames)
-    prediction = model.predict(features)[0]
+    if engine is not None:
+        with metrics.timed("ml.predict_compiled"):
+            prediction = engine.predict_one(record)
+    else:
+        features = pd.DataFrame([record], columns=colnames)
+        prediction = timed_predict(model, features, "ml.predict")[0]
     st.success(f"推定されるメンタルヘルススコアは **{prediction:.2f}** です。")
 
     with st.expander("参考:入力データ", expanded=False):
@@ -124,3 +207,41 @@ if st.session_state["done"]:
     with st.expander("参考:モデルの特徴重要度", expanded=False):
         st.bar_chart(feature_importance.query("importance > 0"),
                      x="column", y="importance", horizontal=True)
+    with st.expander("参考:条件を変えたときのスコア", expanded=False):
+        sens_cols = list(SENSITIVITY_RANGES)
+        col_x, col_y = st.columns(2)
+        x_col = col_x.selectbox("横軸", sens_cols, index=0)
+        y_col = col_y.selectbox(
+            "縦軸", [c for c in sens_cols if c != x_col], index=0)
+        grid = sensitivity_grid(model, record, tuple(colnames), x_col, y_col)
+        import altair as alt
+
+        heatmap = alt.Chart(grid).mark_rect().encode(
+            x=alt.X(f"{x_col}:Q", bin=alt.Bin(maxbins=50)),
+            y=alt.Y(f"{y_col}:Q", bin=alt.Bin(maxbins=25)),
+            color=alt.Color("mean(score):Q", title="スコア",
+                            scale=alt.Scale(scheme="viridis")),
+            tooltip=[x_col, y_col, alt.Tooltip("score:Q", format=".2f")])
+        st.altair_chart(heatmap, use_container_width=True)
+
+st.markdown("## ファイルで一括予測")
+st.write("次の列を持つ CSV / Parquet をアップロードしてください: "
+         + ", ".join(f"`{c}`" for c in colnames))
+batch_file = st.file_uploader("データファイル", type=["csv", "parquet"])
+if batch_file is not None and st.button("一括予測"):
+    num_colnames = prep.named_transformers_["num"].feature_names_in_.tolist()
+    try:
+        result_csv, n_rows, n_skipped = predict_file(
+            model, batch_file, colnames, num_colnames)
+    except ValueError as e:
+        st.error(f"ファイルを処理できませんでした: {e}")
+    else:
+        st.session_state["batch_result"] = (batch_file.name, result_csv)
+        if n_skipped:
+            st.warning(f"数値列が不正な {n_skipped:,} 行は予測していません。")
+
+if "batch_result" in st.session_state:
+    name, result_csv = st.session_state["batch_result"]
+    st.download_button("予測結果をダウンロード", result_csv,
+                       file_name=f"{name.rsplit('.', 1)[0]}_prediction.csv",
+                       mime="text/csv")
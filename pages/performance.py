@@ -0,0 +1,36 @@
+import pandas as pd
+import streamlit as st
+
+import metrics
+
+st.markdown("# パフォーマンス")
+st.write("このプロセスで記録した処理時間・エラー数・データサイズです（直近 "
+         f"{metrics.SAMPLE_SIZE} 回分からパーセンタイルを計算）。")
+
+rows = metrics.snapshot()
+counters = metrics.counters()
+if not rows and not counters:
+    st.info("まだ計測データがありません。各ページを使うと記録されます。")
+else:
+    if rows:
+        table = pd.DataFrame(rows).set_index("name")
+        st.dataframe(table.style.format({
+            "p50_ms": "{:.1f}", "p95_ms": "{:.1f}", "p99_ms": "{:.1f}",
+            "mean_ms": "{:.1f}", "bytes": "{:,}"}), use_container_width=True)
+    if counters:
+        st.markdown("### 回数")
+        st.dataframe(pd.DataFrame({"count": counters}).rename_axis("name"),
+                     use_container_width=True)
+
+    text = metrics.prometheus_text()
+    st.download_button("Prometheus 形式でダウンロード", text,
+                       file_name="metrics.prom", mime="text/plain")
+    with st.expander("Prometheus 形式", expanded=False):
+        st.code(text)
+
+col1, col2 = st.columns(2)
+if col1.button("更新"):
+    st.rerun()
+if col2.button("リセット"):
+    metrics.reset()
+    st.rerun()
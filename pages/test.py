@@ -1,10 +1,20 @@
-import streamlit as st
+import os
+
 import requests
-import json
+import streamlit as st
 
 from datetime import date
 from dateutil.relativedelta import relativedelta
 
+import http_client
+import metrics
+import people_store
+
+KNOWN_PEOPLE_PATH = "assets/known_people.json"
+ENAMAE_BASE = os.environ.get("ENAMAE_BASE", "https://enamae.net")
+# リダイレクト先を調べるだけなので短めにする（共有セッションの再試行ぶん、最大で数倍かかる）
+ONOMANCY_TIMEOUT = (3, 5)
+
 # 年齢計算
 
 
@@ -14,24 +24,23 @@ def calc_age(birth_day):
     return age
 
 
-def check_known(family_name, first_name, birth_day):
-    with open("assets/known_people.json", "r", encoding="utf-8") as f:
-        known_people = json.load(f)
+@st.cache_resource
+def get_known_people():
+    # プロセスで1度だけ開く。名簿ファイルが更新されたらストア側で読み直す
+    return people_store.open_store(KNOWN_PEOPLE_PATH)
 
-    user = {
-        "family_name": family_name,
-        "first_name": first_name,
-        "birth_day": birth_day.strftime("%Y-%m-%d")
-    }
 
-    return user in known_people
+@metrics.timed("people.check_known")
+def check_known(family_name, first_name, birth_day):
+    return get_known_people().contains(
+        family_name, first_name, birth_day.strftime("%Y-%m-%d"))
 
 
-@st.cache_data
+@http_client.ttl_cache(maxsize=1024, ttl=24 * 3600)
 def onomancy(family_name, first_name):
-    url = f"https://enamae.net/result/{family_name}__{first_name}.webp"
-    response = requests.get(url)
-    return response.url
+    url = f"{ENAMAE_BASE}/result/{family_name}__{first_name}.webp"
+    # 画像本体はブラウザが取りに行くので、ここではリダイレクト先だけを調べる
+    return http_client.resolve_redirect(url, timeout=ONOMANCY_TIMEOUT)
 
 
 st.markdown("# 姓名判断アプリ")
@@ -49,4 +58,7 @@ if st.button("判定"):
     if check_known(family_name, first_name, birth_day):
         st.text("あなたのことはよく知っていますよ。")
     st.text(f"こんにちは、{full_name} ({age}歳)さん。こちらがあなたの姓名判断結果です。")
-    st.image(onomancy(family_name, first_name))
+    try:
+        st.image(onomancy(family_name, first_name))
+    except requests.RequestException as e:
+        st.error(f"姓名判断の結果を取得できませんでした。しばらくしてからもう一度お試しください。（{e}）")
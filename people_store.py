@@ -0,0 +1,174 @@
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+# これより大きい名簿は SQLite に索引化して、JSON 全体をメモリに持たない
+SQLITE_THRESHOLD_BYTES = 32 * 1024 * 1024
+_READ_CHUNK = 1 << 20
+_SEPARATORS_RE = re.compile(r"[\s,]*")
+_CREATE_PEOPLE = (
+    "CREATE TABLE IF NOT EXISTS {} ("
+    " family_name TEXT, first_name TEXT, birth_day TEXT,"
+    " PRIMARY KEY (family_name, first_name, birth_day)) WITHOUT ROWID")
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _iter_array(f, chunk_size=_READ_CHUNK):
+    """JSON 配列を要素ごとに読む。ファイル全体をメモリに載せない。"""
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk_size).lstrip()
+    if not buf.startswith("["):
+        raise ValueError("known people file must be a JSON array")
+    pos = 1
+    while True:
+        pos = _SEPARATORS_RE.match(buf, pos).end()
+        if buf.startswith("]", pos):
+            return
+        try:
+            if pos == len(buf):
+                raise ValueError("need more data")
+            item, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # 要素がチャンクの境目で切れているので続きを読む
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError("known people file ends in the middle of the array")
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield item
+
+
+def _read_people(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for person in _iter_array(f):
+            yield person["family_name"], person["first_name"], person["birth_day"]
+
+
+class JsonStore:
+    """名簿 JSON を1度だけ読み、(姓, 名, 生年月日) の集合で引く。
+
+    ファイルの更新時刻が変わったら読み直す。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._people = frozenset()
+
+    def _refresh(self):
+        mtime = _mtime(self.path)
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._people = frozenset(_read_people(self.path)) \
+                        if mtime is not None else frozenset()
+                    self._mtime = mtime
+
+    def contains(self, family_name, first_name, birth_day):
+        self._refresh()
+        return (family_name, first_name, birth_day) in self._people
+
+
+class SqliteStore:
+    """名簿を SQLite の主キー索引に入れて引く。
+
+    元の JSON が更新されていたら、バックグラウンドで索引を作り直して入れ替える。
+    作り直している間は前の索引で答える（索引がまだ1つもないときだけ待つ）。
+    JSON がなければ既存の索引ファイルだけを使う。索引は
+    `python people_store.py` で前もって作っておける。
+    """
+
+    def __init__(self, path, db_path=None):
+        self.path = path
+        self.db_path = db_path or os.path.splitext(path)[0] + ".sqlite3"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # 作り直しの書き込み中も読めるようにする
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_CREATE_PEOPLE.format("people"))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+        self._mtime = self._built_from()
+        self._building = False
+        self._failed_mtime = None
+
+    def _built_from(self):
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'source_mtime'").fetchone()
+        return int(row[0]) if row else None
+
+    def rebuild(self, mtime=None):
+        """別の接続で新しい表を作り、できあがったら今の索引と入れ替える。"""
+        mtime = _mtime(self.path) if mtime is None else mtime
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.execute("DROP TABLE IF EXISTS people_new")
+                conn.execute(_CREATE_PEOPLE.format("people_new"))
+                conn.executemany("INSERT OR IGNORE INTO people_new VALUES (?, ?, ?)",
+                                 _read_people(self.path))
+            with conn:
+                conn.execute("DROP TABLE people")
+                conn.execute("ALTER TABLE people_new RENAME TO people")
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('source_mtime', ?)", (str(mtime),))
+        finally:
+            conn.close()
+        self._mtime = mtime
+
+    def _rebuild_in_background(self, mtime):
+        try:
+            self.rebuild(mtime)
+        except (OSError, ValueError, KeyError, sqlite3.Error):
+            # 壊れた名簿は同じファイルのまま何度も読み直さない
+            self._failed_mtime = mtime
+        finally:
+            with self._lock:
+                self._building = False
+
+    def contains(self, family_name, first_name, birth_day):
+        mtime = _mtime(self.path)
+        with self._lock:
+            if mtime is not None and mtime not in (self._mtime, self._failed_mtime):
+                if self._mtime is None:
+                    self.rebuild(mtime)
+                elif not self._building:
+                    self._building = True
+                    threading.Thread(target=self._rebuild_in_background,
+                                     args=(mtime,), daemon=True).start()
+            row = self._conn.execute(
+                "SELECT 1 FROM people WHERE family_name = ? AND first_name = ?"
+                " AND birth_day = ?", (family_name, first_name, birth_day)).fetchone()
+        return row is not None
+
+
+def open_store(path, backend="auto"):
+    """backend は "json" / "sqlite" / "auto"（ファイルの大きさで選ぶ）。"""
+    if backend == "auto":
+        size = os.path.getsize(path) if os.path.exists(path) else None
+        backend = "json" if size is not None and size < SQLITE_THRESHOLD_BYTES \
+            else "sqlite"
+    if backend == "json":
+        return JsonStore(path)
+    if backend == "sqlite":
+        return SqliteStore(path)
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+if __name__ == "__main__":
+    # 大きな名簿の索引を前もって作る: python people_store.py [名簿.json]
+    store = SqliteStore(sys.argv[1] if len(sys.argv) > 1 else "assets/known_people.json")
+    store.rebuild()
+    print(f"Indexed {store.path} -> {store.db_path}")
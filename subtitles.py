@@ -0,0 +1,82 @@
+from bisect import bisect_right
+from typing import NamedTuple
+
+
+class Cue(NamedTuple):
+    start: float
+    end: float
+    text: str
+
+
+def _timestamp(seconds: float, sep: str) -> str:
+    ms = int(round(seconds * 1000))
+    h, ms = divmod(ms, 3_600_000)
+    m, ms = divmod(ms, 60_000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d}{sep}{ms:03d}"
+
+
+class Timeline:
+    """extract_words の単語リストを字幕キューにまとめたもの。
+
+    再生位置からのキュー検索は二分探索で行う。WebVTT / SRT に書き出して
+    ブラウザ側のプレイヤーに表示タイミングを任せられる。
+    """
+
+    def __init__(self, cues):
+        self.cues = list(cues)
+        self._starts = [c.start for c in self.cues]
+
+    @classmethod
+    def from_words(cls, words, *, max_chars: int = 32, max_duration: float = 5.0,
+                   max_gap: float = 1.0):
+        """単語を文字数・長さ・無音の間隔で区切ってキューにする。"""
+        cues = []
+        group = []
+
+        def flush():
+            if group:
+                text = " ".join(w["word"] for w in group)
+                cues.append(Cue(group[0]["startTime"], group[-1]["endTime"], text))
+                group.clear()
+
+        for w in words:
+            if group:
+                chars = sum(len(g["word"]) + 1 for g in group) + len(w["word"])
+                if (chars > max_chars
+                        or w["endTime"] - group[0]["startTime"] > max_duration
+                        or w["startTime"] - group[-1]["endTime"] > max_gap):
+                    flush()
+            group.append(w)
+        flush()
+
+        # 長さ 0 のキューはプレイヤーに無視されるので、次のキューまで延ばす
+        for i, cue in enumerate(cues):
+            if cue.end <= cue.start:
+                limit = cues[i + 1].start if i + 1 < len(cues) else cue.start + 1.0
+                cues[i] = cue._replace(end=max(limit, cue.start + 0.1))
+        return cls(cues)
+
+    def cue_at(self, t: float):
+        """再生位置 t 秒に表示中のキューを返す（なければ None）。"""
+        i = bisect_right(self._starts, t) - 1
+        if i >= 0 and t < self.cues[i].end:
+            return self.cues[i]
+        return None
+
+    def to_webvtt(self) -> str:
+        lines = ["WEBVTT", ""]
+        for cue in self.cues:
+            lines.append(f"{_timestamp(cue.start, '.')} --> {_timestamp(cue.end, '.')}")
+            lines.append(cue.text)
+            lines.append("")
+        return "\n".join(lines)
+
+    def to_srt(self) -> str:
+        lines = []
+        for i, cue in enumerate(self.cues, 1):
+            lines.append(str(i))
+            lines.append(f"{_timestamp(cue.start, ',')} --> {_timestamp(cue.end, ',')}")
+            lines.append(cue.text)
+            lines.append("")
+        return "\n".join(lines)
@@ -1,40 +1,193 @@
+from __future__ import annotations
+
 import base64
+import binascii
+import datetime
+import hashlib
 import io
 import json
+import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
 import requests
-from pydub import AudioSegment
-from google.oauth2 import service_account
-from google.auth.transport.requests import Request
+
+import http_client
+import metrics
+
+# pydub と google-auth は実際に音声を扱う・トークンを取るときに読み込む
+if TYPE_CHECKING:
+    from pydub import AudioSegment
 
 _SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
-_STT_ENDPOINT = "https://speech.googleapis.com/v1/speech:recognize"
+# 環境変数で差し替えられる（benchmarks/fake_services.py のローカルサーバーなど）
+_STT_ENDPOINT = os.environ.get(
+    "STT_ENDPOINT", "https://speech.googleapis.com/v1/speech:recognize")
+_RECOGNITION_CONFIG = {
+    "languageCode": "ja-JP",
+    "enableWordTimeOffsets": True,
+    "audioChannelCount": 1
+}
+
+# 同期 recognize は 1 分程度が上限なので、それより長い音声は分割して送る
+LONG_AUDIO_MS = 55_000
+_CHUNK_MS = 50_000
+_OVERLAP_MS = 2_000
+# 区切り位置の前方この範囲で無音区間を探す
+_SILENCE_SEARCH_MS = 5_000
+_MIN_SILENCE_MS = 300
+_MAX_WORKERS = 4
+# 5xx・タイムアウト・接続エラーのとき、1回の認識（チャンク）をやり直す回数と待ち時間の基準（秒）
+_RETRIES = 2
+_RETRY_BACKOFF = 0.5
+
+# Speech-to-Text の推奨サンプリングレート。これ以上は精度が上がらず送信量だけ増える
+TARGET_SAMPLE_RATE = 16_000
+# base64 化はこのバイト数（3 の倍数）ずつ行う
+_B64_BLOCK = 3 * 64 * 1024
+
+# 有効期限のこの時間前になったらトークンを更新する
+_TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+
+class SpeechClient:
+    """Speech-to-Text 呼び出し用のプロセス共有クライアント。
+
+    サービスアカウントの認証情報をキャッシュして期限切れ直前にだけ更新する。
+    通信は http_client の共有セッションで行う。複数スレッドから呼んでよい。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._credentials = {}
+
+    def token(self, sa_info: dict) -> str:
+        from google.auth.transport.requests import Request
+        from google.oauth2 import service_account
+
+        key = sa_info.get("client_email")
+        with self._lock:
+            creds = self._credentials.get(key)
+            if creds is None:
+                creds = service_account.Credentials.from_service_account_info(
+                    sa_info, scopes=_SCOPES)
+                self._credentials[key] = creds
+            if creds.token is None or creds.expiry is None or \
+                    creds.expiry - _TOKEN_REFRESH_MARGIN <= _utcnow():
+                creds.refresh(Request(session=http_client.get_session()))
+            return creds.token
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return http_client.post(url, **kwargs)
+
 
+def _utcnow() -> datetime.datetime:
+    # google-auth の expiry はタイムゾーンなしの UTC
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
 
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> SpeechClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SpeechClient()
+    return _client
+
+
+@metrics.timed("stt.access_token")
 def _get_access_token(sa_info: dict) -> str:
-    creds = service_account.Credentials.from_service_account_info(
-        sa_info, scopes=_SCOPES)
-    creds.refresh(Request())
-    return creds.token
+    return get_client().token(sa_info)
 
 
-def encode_audio(audio_bytes: bytes) -> str:
-    # WAV をモノラル化（サンプリングレートは維持。WAV/FLACはヘッダで自動判定してくれる）
-    seg = AudioSegment.from_wav(io.BytesIO(audio_bytes)).set_channels(1)
+@metrics.timed("audio.load")
+def load_audio(audio_bytes: bytes) -> AudioSegment:
+    # WAV をモノラル化（サンプリングレートは維持）
+    from pydub import AudioSegment
+
+    return AudioSegment.from_wav(io.BytesIO(audio_bytes)).set_channels(1)
+
+
+def encode_segment(seg: AudioSegment) -> str:
+    # WAV/FLACはヘッダで自動判定してくれる
     buf = io.BytesIO()
     seg.export(buf, format="wav")
     return base64.b64encode(buf.getvalue()).decode("utf-8")
 
 
-def get_response(encoded_audio: str, *, sa_info: dict = None, api_key: str = None):
+def encode_audio(audio_bytes: bytes) -> str:
+    return encode_segment(load_audio(audio_bytes))
+
+
+def normalize_audio(seg: AudioSegment,
+                    sample_rate: int = TARGET_SAMPLE_RATE) -> AudioSegment:
+    # モノラル・16bit・sample_rate に揃える（すでに揃っていればコピーしない）
+    return seg.set_channels(1).set_frame_rate(sample_rate).set_sample_width(2)
+
+
+def b64encode_stream(data) -> bytearray:
+    """data をブロックごとに base64 化し、確保済みのバッファへ直接書き込む。"""
+    mv = memoryview(data).cast("B")
+    out = bytearray(4 * ((len(mv) + 2) // 3))
+    pos = 0
+    for i in range(0, len(mv), _B64_BLOCK):
+        block = binascii.b2a_base64(mv[i:i + _B64_BLOCK], newline=False)
+        out[pos:pos + len(block)] = block
+        pos += len(block)
+    return out
+
+
+@metrics.timed("audio.encode")
+def encode_segment_compact(seg: AudioSegment, *, encoding: str = "LINEAR16",
+                           sample_rate: int = TARGET_SAMPLE_RATE):
+    """16kHz モノラルに変換して (base64 バイト列, 認識設定) を返す。
+
+    encoding は "LINEAR16"（ヘッダなし PCM）か "FLAC"。返した設定は
+    get_response の config にそのまま渡す。
+    """
+    seg = normalize_audio(seg, sample_rate)
+    if encoding == "LINEAR16":
+        data = seg.raw_data
+    elif encoding == "FLAC":
+        buf = io.BytesIO()
+        seg.export(buf, format="flac")
+        data = buf.getbuffer()
+    else:
+        raise ValueError(f"Unsupported encoding: {encoding}")
+    config = {"encoding": encoding, "sampleRateHertz": sample_rate}
+    return b64encode_stream(data), config
+
+
+def encode_audio_compact(audio_bytes: bytes, **kwargs):
+    return encode_segment_compact(load_audio(audio_bytes), **kwargs)
+
+
+def _build_body(payload: dict, encoded_audio) -> bytearray:
+    # base64 はエスケープ不要なので、JSON の前後だけ組み立ててそのまま埋め込む
+    head = json.dumps({**payload, "audio": {"content": ""}})
+    prefix, suffix = head.rsplit('""', 1)
+    prefix = (prefix + '"').encode("utf-8")
+    suffix = ('"' + suffix).encode("utf-8")
+    body = bytearray(len(prefix) + len(encoded_audio) + len(suffix))
+    body[:len(prefix)] = prefix
+    body[len(prefix):len(prefix) + len(encoded_audio)] = encoded_audio
+    body[len(prefix) + len(encoded_audio):] = suffix
+    return body
+
+
+def get_response(encoded_audio, *, sa_info: dict = None, api_key: str = None,
+                 config: dict = None):
     # WAV の場合は encoding / sampleRate を送らない（自動判定）← 公式仕様
+    # encode_segment_compact の結果を送る場合は、その設定を config に渡す
     payload = {
-        "config": {
-            "languageCode": "ja-JP",
-            "enableWordTimeOffsets": True,
-            "audioChannelCount": 1
-        },
-        "audio": {"content": encoded_audio}
+        "config": {**_RECOGNITION_CONFIG, **(config or {})},
     }
 
     headers = {"Content-Type": "application/json; charset=utf-8"}
@@ -50,18 +203,151 @@ def get_response(encoded_audio: str, *, sa_info: dict = None, api_key: str = Non
         raise RuntimeError(
             "No credentials provided. Provide service account info or API key.")
 
-    resp = requests.post(url, headers=headers, json=payload, timeout=60)
+    if isinstance(encoded_audio, str):
+        payload["audio"] = {"content": encoded_audio}
+        body = {"json": payload}
+    else:
+        body = {"data": _build_body(payload, encoded_audio)}
+    with metrics.timed("stt.recognize") as timer:
+        resp = get_client().post(url, headers=headers, timeout=60, **body)
+        timer.add_size(len(body["data"]) if "data" in body else len(encoded_audio))
+        if resp.status_code >= 400:
+            timer.mark_error()
     return resp
 
 
-def extract_words(data: dict):
-    alts = data["results"][0]["alternatives"][0]
-    words = alts.get("words", [])
-    return [
-        {
-            "word": w["word"],
-            "startTime": float(w["startTime"].rstrip("s")),
-            "endTime": float(w["endTime"].rstrip("s")),
-        }
-        for w in words
-    ]
+def _recognize(encoded_audio, *, sa_info: dict = None, api_key: str = None,
+               config: dict = None, retries: int = _RETRIES) -> dict:
+    """get_response を呼んで認識結果の JSON を返す。失敗はすべて RuntimeError にする。"""
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(random.uniform(0, _RETRY_BACKOFF * 2 ** attempt))
+        try:
+            resp = get_response(encoded_audio, sa_info=sa_info, api_key=api_key,
+                                config=config)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            if attempt < retries:
+                continue
+            raise RuntimeError(f"Speech-to-Text request failed: {e}") from e
+        except requests.RequestException as e:
+            raise RuntimeError(f"Speech-to-Text request failed: {e}") from e
+        if resp.status_code >= 500 and attempt < retries:
+            continue
+        try:
+            data = resp.json()
+        except ValueError as e:
+            raise RuntimeError(
+                f"Invalid Speech-to-Text response (HTTP {resp.status_code})") from e
+        if "error" in data:
+            error = data["error"]
+            raise RuntimeError(error.get("message", str(error))
+                               if isinstance(error, dict) else str(error))
+        return data
+
+
+def extract_words(data: dict, *, offset: float = 0.0,
+                  start: float = None, end: float = None):
+    """認識結果から単語リストを取り出す。
+
+    offset 秒だけ時刻をずらし、start 以上 end 未満に始まる単語だけを残す
+    （分割送信したチャンクの重なり部分で単語が重複しないようにするため）。
+    """
+    words = []
+    for result in data.get("results", []):
+        alts = result.get("alternatives") or [{}]
+        for w in alts[0].get("words", []):
+            begin = float(w["startTime"].rstrip("s")) + offset
+            if start is not None and begin < start:
+                continue
+            if end is not None and begin >= end:
+                continue
+            words.append({
+                "word": w["word"],
+                "startTime": begin,
+                "endTime": float(w["endTime"].rstrip("s")) + offset,
+            })
+    return words
+
+
+def _find_cut(seg: AudioSegment, end_ms: int, silence_thresh: float) -> int:
+    """end_ms の手前で最も近い無音区間の中央を返す（見つからなければ end_ms）。"""
+    from pydub.silence import detect_silence
+
+    window_start = max(0, end_ms - _SILENCE_SEARCH_MS)
+    window = seg[window_start:end_ms]
+    silences = detect_silence(
+        window, min_silence_len=_MIN_SILENCE_MS, silence_thresh=silence_thresh)
+    if not silences:
+        return end_ms
+    silence_start, silence_end = silences[-1]
+    return window_start + (silence_start + silence_end) // 2
+
+
+def split_audio(seg: AudioSegment, *, chunk_ms: int = _CHUNK_MS,
+                overlap_ms: int = _OVERLAP_MS):
+    """音声を重なり付きのチャンクに分割し、(開始ms, 終了ms) のリストを返す。
+
+    区切りはなるべく無音区間に合わせる。
+    """
+    total = len(seg)
+    silence_thresh = seg.dBFS - 16
+    bounds = []
+    start = 0
+    while True:
+        end = min(start + chunk_ms, total)
+        if end < total:
+            end = max(_find_cut(seg, end, silence_thresh),
+                      start + overlap_ms + 1)
+        bounds.append((start, end))
+        if end >= total:
+            return bounds
+        start = end - overlap_ms
+
+
+def transcribe_long(seg: AudioSegment, *, sa_info: dict = None, api_key: str = None,
+                    max_workers: int = _MAX_WORKERS):
+    """長い音声をチャンクに分けて並列に認識し、1つの単語リストにまとめる。"""
+    seg = normalize_audio(seg)
+    bounds = split_audio(seg)
+
+    def recognize(bound):
+        start_ms, end_ms = bound
+        encoded_audio, config = encode_segment_compact(seg[start_ms:end_ms])
+        return _recognize(encoded_audio, sa_info=sa_info, api_key=api_key,
+                          config=config)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(bounds))) as pool:
+        results = list(pool.map(recognize, bounds))
+
+    words = []
+    for i, ((start_ms, end_ms), data) in enumerate(zip(bounds, results)):
+        # 重なり部分は中央で前後のチャンクに振り分ける
+        start = None
+        end = None
+        if i > 0:
+            start = (start_ms + bounds[i - 1][1]) / 2000
+        if i + 1 < len(bounds):
+            end = (bounds[i + 1][0] + end_ms) / 2000
+        words.extend(extract_words(data, offset=start_ms / 1000,
+                                   start=start, end=end))
+    return words
+
+
+@metrics.timed("audio.transcribe")
+def transcribe(seg: AudioSegment, *, sa_info: dict = None, api_key: str = None):
+    """音声を認識して単語リストを返す。長い音声は transcribe_long に回す。"""
+    if len(seg) > LONG_AUDIO_MS:
+        return transcribe_long(seg, sa_info=sa_info, api_key=api_key)
+    encoded_audio, config = encode_segment_compact(seg)
+    data = _recognize(encoded_audio, sa_info=sa_info, api_key=api_key, config=config)
+    return extract_words(data)
+
+
+def transcript_key(seg: AudioSegment) -> str:
+    """正規化した音声と認識設定から、文字起こし結果のキャッシュキーを作る。"""
+    seg = normalize_audio(seg)
+    h = hashlib.sha256()
+    h.update(json.dumps(_RECOGNITION_CONFIG, sort_keys=True).encode("utf-8"))
+    h.update(str(seg.frame_rate).encode("utf-8"))
+    h.update(seg.raw_data)
+    return h.hexdigest()